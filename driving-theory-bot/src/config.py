@@ -1,4 +1,24 @@
 """Configuration settings for the driving theory bot"""
 
 # Quiz settings
-QUESTION_DELAY_SECONDS = 30  # Time to wait between questions in seconds
\ No newline at end of file
+QUESTION_DELAY_SECONDS = 30  # Time to wait between questions in seconds
+
+# Database settings, passed to DatabaseManager
+DATABASE = {
+    'pool_size': 20,  # Number of concurrent database connections
+    'batch_size': 100,  # Queued writes that trigger an early batch flush
+    'batch_interval': 2.0,  # Seconds between batch writes
+    'cache_size': 64000,  # SQLite page cache per connection, in KiB
+    'user_cache_size': 10000,  # Users whose profile, attempted questions and session stay in memory
+    'max_write_rate': 2000,  # Attempt rows flushed per second (token bucket rate)
+    'max_write_burst': 5000,  # Token bucket burst capacity, in rows
+    'max_pending_writes': 50000,  # Reject new attempts beyond this queue length
+    'cached_statements': 256,  # Prepared statements kept per connection; covers every query the bot issues
+}
+
+# Question settings
+QUESTION_CACHE_SIZE = 128  # LRU cache size for per-language question pools
+
+# Telegram settings
+CONCURRENT_UPDATES = 256  # Updates processed concurrently
+CONNECTION_POOL_SIZE = 256  # HTTP keep-alive pool; match CONCURRENT_UPDATES so replies never queue
\ No newline at end of file
@@ -1,14 +1,150 @@
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Set, Tuple
 from functools import lru_cache
 import logging
 import json
 
 from .db_pool import DatabasePool
+from utils.rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the schema script below changes so existing databases re-run it
+SCHEMA_VERSION = 6
+
+# Attempt, review and session times are stored as unix epoch milliseconds
+DAY_MS = 86400000
+
+# Hot-path SQL is kept in module-level constants so every call passes the
+# same string and hits sqlite3's per-connection statement cache
+SQL_UPSERT_USER = """
+    INSERT INTO users (telegram_id, username) VALUES (?, ?)
+    ON CONFLICT(telegram_id) DO UPDATE SET username = COALESCE(excluded.username, users.username)
+    RETURNING *
+"""
+
+SQL_UPDATE_USER_LANGUAGE = "UPDATE users SET preferred_language = ? WHERE telegram_id = ?"
+
+SQL_INSERT_ATTEMPT = """
+    INSERT INTO question_attempts
+    (user_telegram_id, question_id, language, is_correct, time_taken_seconds, attempted_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Formatted with one "(?, ?)" pair per user in the batch
+SQL_INCREMENT_USER_TOTALS = """
+    WITH deltas(uid, cnt) AS (VALUES {values})
+    UPDATE users SET total_questions_answered = total_questions_answered + deltas.cnt
+    FROM deltas WHERE users.telegram_id = deltas.uid
+"""
+# Users per statement, keeping bound parameters under SQLite's 999 default limit
+USER_TOTALS_CHUNK_SIZE = 256
+
+SQL_USER_STATISTICS = """
+    SELECT
+        COUNT(*) as total_attempts,
+        SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_answers,
+        AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) * 100 as accuracy_percentage
+    FROM question_attempts
+    WHERE user_telegram_id = ?
+"""
+
+# SET expressions see the pre-update row, so the new interval is
+# derived from the old interval and the new ease factor inline
+SQL_UPSERT_SPACED_REPETITION = """
+    INSERT INTO spaced_repetition
+    (user_telegram_id, question_id, language, next_review, last_reviewed)
+    VALUES (:user_id, :question_id, :language, :next_review, :now)
+    ON CONFLICT(user_telegram_id, question_id, language) DO UPDATE SET
+        ease_factor = CASE WHEN :is_correct
+            THEN MIN(ease_factor + 0.1, 3.0)
+            ELSE MAX(ease_factor - 0.2, 1.3) END,
+        interval_days = CASE WHEN :is_correct
+            THEN MAX(1, CAST(interval_days * MIN(ease_factor + 0.1, 3.0) AS INTEGER))
+            ELSE 1 END,
+        repetition_count = CASE WHEN :is_correct THEN repetition_count + 1 ELSE 0 END,
+        next_review = excluded.last_reviewed + 86400000 * CASE WHEN :is_correct
+            THEN MAX(1, CAST(interval_days * MIN(ease_factor + 0.1, 3.0) AS INTEGER))
+            ELSE 1 END,
+        last_reviewed = excluded.last_reviewed
+"""
+
+SQL_NEXT_REVIEW = """
+    SELECT question_id FROM spaced_repetition
+    WHERE user_telegram_id = ? AND language = ? AND next_review <= ?
+    ORDER BY next_review ASC LIMIT 1
+"""
+
+SQL_ATTEMPTED_QUESTIONS = """
+    SELECT question_id FROM question_attempts
+    WHERE user_telegram_id = ? AND language = ?
+    GROUP BY question_id
+    ORDER BY MAX(attempted_at) DESC
+    LIMIT 1000  -- Limit for performance
+"""
+
+SQL_SAVE_SESSION = """
+    INSERT OR REPLACE INTO user_sessions
+    (user_telegram_id, current_question_id, language, question_start_time, awaiting_answer, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_GET_SESSION = "SELECT * FROM user_sessions WHERE user_telegram_id = ?"
+
+SQL_CLEAR_SESSION = "DELETE FROM user_sessions WHERE user_telegram_id = ?"
+
+SQL_ACTIVE_SESSIONS = """
+    SELECT * FROM user_sessions
+    WHERE awaiting_answer = 1
+    AND updated_at > ?
+    ORDER BY updated_at DESC
+    LIMIT 10000  -- Limit for safety
+"""
+
+SQL_MEDIA_FILE_IDS = "SELECT path, file_id FROM media_cache"
+
+SQL_SAVE_MEDIA_FILE_ID = "INSERT OR REPLACE INTO media_cache (path, file_id, kind) VALUES (?, ?, ?)"
+
+SQL_DELETE_MEDIA_FILE_ID = "DELETE FROM media_cache WHERE path = ?"
+
+SESSION_COLUMNS = (
+    'user_telegram_id', 'current_question_id', 'language',
+    'question_start_time', 'awaiting_answer', 'updated_at'
+)
+
+_MISSING = object()  # Cache-miss sentinel where None is a cached value
+
+
+def _now_ms() -> int:
+    """Current time as unix epoch milliseconds"""
+    return int(time.time() * 1000)
+
+
+def _script_statements(script: str) -> List[str]:
+    """Split a SQL script into statements; executescript() would commit an open transaction"""
+    statements = []
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ""
+    return statements
+
+
+@lru_cache(maxsize=None)
+def _user_totals_sql(rows: int) -> str:
+    """Totals UPDATE for a given row count, built once so its text repeats across flushes"""
+    return SQL_INCREMENT_USER_TOTALS.format(values=", ".join(["(?, ?)"] * rows))
+
+
+class WriteQueueFullError(RuntimeError):
+    """Raised when the pending write queue is at capacity and a write is shed"""
+
 
 class DatabaseManager:
     """
@@ -16,18 +152,55 @@ class DatabaseManager:
     Uses connection pooling, caching, and batch operations.
     """
     
-    def __init__(self, db_path: str = "driving_theory_bot.db", pool_size: int = 20):
-        self.pool = DatabasePool(db_path, pool_size)
-        self._user_cache = {}  # Simple cache for user data
-        self._cache_lock = asyncio.Lock()
+    def __init__(
+        self,
+        db_path: str = "driving_theory_bot.db",
+        pool_size: int = 20,
+        batch_size: int = 100,
+        batch_interval: float = 2.0,
+        cache_size: int = 64000,
+        user_cache_size: int = 10000,
+        max_write_rate: float = 2000,
+        max_write_burst: int = 5000,
+        max_pending_writes: int = 50000,
+        cached_statements: int = 256
+    ):
+        self.pool = DatabasePool(db_path, pool_size, cache_size, cached_statements)
+        # LRU cache for user data. Cache and batch queue updates never span an
+        # await, so they are atomic on the event loop and need no locks.
+        self._user_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.user_cache_size = user_cache_size
+        # Attempted question ids per (user, language), same LRU bound as the user cache
+        self._attempted_cache: "OrderedDict[Tuple[int, str], Set[str]]" = OrderedDict()
         self._batch_queue = []
-        self._batch_lock = asyncio.Lock()
+        # Latest pending session state per user (None = delete), coalesced until the next flush
+        self._pending_sessions: Dict[int, Optional[tuple]] = {}
+        # Last known session row per user (None = no session). Written through on every
+        # save and clear, and this process is the only writer, so entries need no expiry.
+        self._session_cache: "OrderedDict[int, Optional[tuple]]" = OrderedDict()
+        self._batch_ready = asyncio.Event()  # Set when the queue reaches batch_size
+        # Attempts taken off the queue but not yet committed are in neither place,
+        # so statistics and attempted-set reads wait out a running flush and retry
+        # if one starts
+        self._flush_idle = asyncio.Event()
+        self._flush_idle.set()
+        self._flush_count = 0
         self._batch_task = None
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        # Caps attempt rows written per second so a backlog cannot stall readers
+        self._write_bucket = TokenBucket(rate=max_write_rate, burst=max_write_burst)
+        self.max_pending_writes = max_pending_writes
     
     async def connect(self):
         """Initialize database pool and create tables"""
         await self.pool.initialize()
-        await self.initialize_database()
+        try:
+            await self.initialize_database()
+        except Exception:
+            # Don't leave the writer and reader connection threads running
+            await self.pool.close()
+            raise
         
         # Start batch processor
         self._batch_task = asyncio.create_task(self._process_batch_writes())
@@ -41,12 +214,12 @@ class DatabaseManager:
             except asyncio.CancelledError:
                 pass
         
-        # Process any remaining batch writes
-        await self._flush_batch()
+        # Process any remaining batch writes, bypassing the write rate limit
+        await self._flush_batch(rate_limited=False)
         await self.pool.close()
     
     async def initialize_database(self):
-        """Create database tables with optimized schema"""
+        """Create database tables with optimized schema, once per schema version"""
         schema = """
             CREATE TABLE IF NOT EXISTS users (
                 telegram_id INTEGER PRIMARY KEY,
@@ -54,96 +227,192 @@ class DatabaseManager:
                 preferred_language TEXT NOT NULL DEFAULT 'english',
                 created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 total_questions_answered INTEGER DEFAULT 0
-            ) WITHOUT ROWID;
+            );
 
             CREATE TABLE IF NOT EXISTS question_attempts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 user_telegram_id INTEGER NOT NULL,
                 question_id TEXT NOT NULL,
                 language TEXT NOT NULL,
                 is_correct BOOLEAN NOT NULL,
-                attempted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                -- Unix epoch milliseconds
+                attempted_at INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
                 time_taken_seconds INTEGER,
                 FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
             );
 
+            -- Clustered on its natural key: lookups and upserts are one B-tree descent
             CREATE TABLE IF NOT EXISTS spaced_repetition (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_telegram_id INTEGER NOT NULL,
                 question_id TEXT NOT NULL,
                 language TEXT NOT NULL,
                 repetition_count INTEGER DEFAULT 0,
                 ease_factor REAL DEFAULT 2.5,
                 interval_days INTEGER DEFAULT 1,
-                next_review TIMESTAMP NOT NULL,
-                last_reviewed TIMESTAMP NOT NULL,
-                UNIQUE(user_telegram_id, question_id, language),
+                next_review INTEGER NOT NULL,  -- Unix epoch milliseconds
+                last_reviewed INTEGER NOT NULL,  -- Unix epoch milliseconds
+                PRIMARY KEY (user_telegram_id, question_id, language),
                 FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
-            );
+            ) WITHOUT ROWID;
 
             CREATE TABLE IF NOT EXISTS user_sessions (
                 user_telegram_id INTEGER PRIMARY KEY,
                 current_question_id TEXT NOT NULL,
                 language TEXT NOT NULL,
-                question_start_time TIMESTAMP,
+                question_start_time INTEGER,  -- Unix epoch milliseconds
                 awaiting_answer BOOLEAN DEFAULT 1,
-                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
                 FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
+            );
+
+            -- Telegram file_id of each uploaded media file, keyed by its path
+            -- relative to the question set, so restarts don't re-upload
+            CREATE TABLE IF NOT EXISTS media_cache (
+                path TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                kind TEXT NOT NULL
             ) WITHOUT ROWID;
 
             -- Optimized indexes for concurrent access
-            CREATE INDEX IF NOT EXISTS idx_attempts_user_time ON question_attempts(user_telegram_id, attempted_at DESC);
-            CREATE INDEX IF NOT EXISTS idx_attempts_question ON question_attempts(question_id);
-            CREATE INDEX IF NOT EXISTS idx_spaced_user_review ON spaced_repetition(user_telegram_id, next_review);
-            CREATE INDEX IF NOT EXISTS idx_sessions_updated ON user_sessions(updated_at DESC);
+            -- Covers get_user_statistics' per-user COUNT/SUM over is_correct
+            CREATE INDEX IF NOT EXISTS idx_attempts_user_correct ON question_attempts(user_telegram_id, is_correct);
+            -- Nothing orders a user's attempts by time alone any more
+            DROP INDEX IF EXISTS idx_attempts_user_time;
+            -- Covers get_attempted_questions entirely from the index
+            CREATE INDEX IF NOT EXISTS idx_attempts_user_lang_q
+                ON question_attempts(user_telegram_id, language, question_id, attempted_at);
+            -- No query filters on question_id alone; drop to save write amplification
+            DROP INDEX IF EXISTS idx_attempts_question;
+            -- Equality on user and language, then an ordered range on next_review, so
+            -- ORDER BY next_review LIMIT 1 stops at the first due entry; question_id
+            -- rides along so the lookup never touches the table
+            CREATE INDEX IF NOT EXISTS idx_spaced_due
+                ON spaced_repetition(user_telegram_id, language, next_review, question_id);
+            DROP INDEX IF EXISTS idx_spaced_user_lang_review;
+            DROP INDEX IF EXISTS idx_spaced_user_review;
+            -- Partial index matching get_all_active_sessions' predicate
+            CREATE INDEX IF NOT EXISTS idx_sessions_active ON user_sessions(updated_at DESC) WHERE awaiting_answer = 1;
+            DROP INDEX IF EXISTS idx_sessions_updated;
         """
         
-        async with self.pool.acquire() as conn:
-            await conn.executescript(schema)
+        async with self.pool.acquire_write() as conn:
+            async with conn.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())['user_version']
+            if version >= SCHEMA_VERSION:
+                return
+            
+            logger.info(f"Migrating database schema from version {version} to {SCHEMA_VERSION}")
+            async with conn.execute("SELECT COUNT(*) AS tables FROM sqlite_master") as cursor:
+                is_new = (await cursor.fetchone())['tables'] == 0
+            if is_new:
+                # Lets deleted pages be returned a few at a time instead of needing a
+                # full VACUUM. The WAL header is already written, so the setting only
+                # sticks after a VACUUM, which is instant while the file is empty.
+                await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                await conn.execute("VACUUM")
+            
+            # One transaction, version bump included: a failed migration rolls back
+            # to the old tables and runs again from them on the next start
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                await self._rebuild_outdated_tables(conn, schema)
+                for statement in _script_statements(schema):
+                    await conn.execute(statement)
+                # Refresh planner statistics so the covering indexes get picked
+                await conn.execute("PRAGMA analysis_limit=1000")
+                await conn.execute("ANALYZE")
+                await conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            except BaseException:
+                await conn.rollback()
+                raise
             await conn.commit()
     
+    async def _rebuild_outdated_tables(self, conn, schema: str):
+        """
+        Rebuild tables whose storage layout predates the current schema, which
+        CREATE TABLE IF NOT EXISTS cannot change in place. Runs inside the
+        caller's transaction and does not commit.
+        """
+        # Table -> test on its stored DDL showing it needs a rebuild
+        outdated = {
+            # Integer keys are faster as plain rowid aliases (one B-tree lookup)
+            'users': lambda sql: 'WITHOUT ROWID' in sql,
+            # TIMESTAMP columns held ISO text instead of epoch milliseconds
+            'user_sessions': lambda sql: 'WITHOUT ROWID' in sql or 'UPDATED_AT TIMESTAMP' in sql,
+            # AUTOINCREMENT only adds a sqlite_sequence write per insert
+            'question_attempts': lambda sql: 'AUTOINCREMENT' in sql or 'ATTEMPTED_AT TIMESTAMP' in sql,
+            # Surrogate id plus UNIQUE index, instead of clustering on the natural key
+            'spaced_repetition': lambda sql: 'WITHOUT ROWID' not in sql or 'NEXT_REVIEW TIMESTAMP' in sql,
+        }
+        async with conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN (?, ?, ?, ?)",
+            tuple(outdated)
+        ) as cursor:
+            tables = [row['name'] for row in await cursor.fetchall() if outdated[row['name']](row['sql'].upper())]
+        
+        if not tables:
+            return
+        
+        logger.info(f"Rebuilding {', '.join(tables)} with the current table layout")
+        # Legacy rename keeps other tables' foreign keys pointing at the original name
+        await conn.execute("PRAGMA legacy_alter_table=ON")
+        try:
+            for table in tables:
+                await conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            for statement in _script_statements(schema):
+                await conn.execute(statement)
+            for table in tables:
+                # Copy the columns both layouts share; dropped surrogate ids are left behind
+                async with conn.execute(f"PRAGMA table_info({table}_old)") as cursor:
+                    old_types = {row['name']: row['type'] for row in await cursor.fetchall()}
+                async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+                    new_types = {row['name']: row['type'] for row in await cursor.fetchall()}
+                columns = [name for name in new_types if name in old_types]
+                values = [
+                    # Local-time ISO text from older schemas becomes UTC epoch milliseconds
+                    f"CAST(ROUND((julianday({name}, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+                    if old_types[name] == 'TIMESTAMP' and new_types[name] == 'INTEGER' else name
+                    for name in columns
+                ]
+                await conn.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(values)} FROM {table}_old"
+                )
+                await conn.execute(f"DROP TABLE {table}_old")
+        finally:
+            await conn.execute("PRAGMA legacy_alter_table=OFF")
+    
     async def get_or_create_user(self, telegram_id: int, username: Optional[str] = None) -> Dict[str, Any]:
         """Get or create user with caching"""
-        # Check cache first
-        async with self._cache_lock:
-            if telegram_id in self._user_cache:
-                return self._user_cache[telegram_id]
+        # Check cache first; one probe for the lookup, one to refresh recency
+        user_dict = self._user_cache.get(telegram_id)
+        if user_dict is not None:
+            self._user_cache.move_to_end(telegram_id)
+            return user_dict
         
-        # Check database
-        user = await self.pool.fetchone(
-            "SELECT * FROM users WHERE telegram_id = ?", 
-            (telegram_id,)
+        # Insert-or-fetch in a single round-trip
+        user_dict = await self.pool.execute_fetchone(
+            SQL_UPSERT_USER,
+            (telegram_id, username)
         )
         
-        if not user:
-            await self.pool.execute(
-                "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
-                (telegram_id, username)
-            )
-            user = await self.pool.fetchone(
-                "SELECT * FROM users WHERE telegram_id = ?",
-                (telegram_id,)
-            )
-        
-        user_dict = dict(user)
-        
         # Update cache
-        async with self._cache_lock:
-            self._user_cache[telegram_id] = user_dict
+        self._user_cache[telegram_id] = user_dict
+        if len(self._user_cache) > self.user_cache_size:
+            self._user_cache.popitem(last=False)  # Evict least recently used
         
         return user_dict
     
     async def update_user_language(self, telegram_id: int, language: str):
         """Update user language preference"""
         await self.pool.execute(
-            "UPDATE users SET preferred_language = ? WHERE telegram_id = ?",
+            SQL_UPDATE_USER_LANGUAGE,
             (language, telegram_id)
         )
         
         # Update cache
-        async with self._cache_lock:
-            if telegram_id in self._user_cache:
-                self._user_cache[telegram_id]['preferred_language'] = language
+        user_dict = self._user_cache.get(telegram_id)
+        if user_dict is not None:
+            user_dict['preferred_language'] = language
     
     async def record_question_attempt(
         self, 
@@ -154,74 +423,135 @@ class DatabaseManager:
         time_taken_seconds: Optional[int] = None
     ):
         """Queue question attempt for batch processing"""
-        async with self._batch_lock:
-            self._batch_queue.append({
-                'type': 'attempt',
-                'user_telegram_id': user_telegram_id,
-                'question_id': question_id,
-                'language': language,
-                'is_correct': is_correct,
-                'time_taken_seconds': time_taken_seconds,
-                'timestamp': datetime.now()
-            })
+        if len(self._batch_queue) >= self.max_pending_writes:
+            raise WriteQueueFullError(
+                f"Write queue full ({self.max_pending_writes} pending attempts); dropping attempt"
+            )
+        
+        self._batch_queue.append({
+            'type': 'attempt',
+            'user_telegram_id': user_telegram_id,
+            'question_id': question_id,
+            'language': language,
+            'is_correct': is_correct,
+            'time_taken_seconds': time_taken_seconds,
+            'timestamp': _now_ms()
+        })
+        if len(self._batch_queue) + len(self._pending_sessions) >= self.batch_size:
+            self._batch_ready.set()
+        
+        # Keep a warm attempted-set current; cold users are loaded from the DB on demand
+        attempted = self._attempted_cache.get((user_telegram_id, language))
+        if attempted is not None:
+            attempted.add(question_id)
     
     async def _process_batch_writes(self):
-        """Process batch writes periodically"""
+        """Flush batch writes once a full batch is queued or batch_interval elapses"""
         while True:
             try:
-                await asyncio.sleep(2)  # Process every 2 seconds
+                # Jitter keeps flushes from lining up with other periodic work
+                timeout = self.batch_interval * random.uniform(0.9, 1.1)
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._batch_ready.clear()
                 await self._flush_batch()
+                # A throttled flush leaves a backlog that re-arms _batch_ready on every
+                # queued write; wait until the bucket can grant a full batch instead
+                backlog = min(len(self._batch_queue), self.batch_size)
+                if backlog:
+                    await asyncio.sleep(self._write_bucket.time_until(backlog))
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error in batch processor: {e}")
     
-    async def _flush_batch(self):
+    async def _flush_batch(self, rate_limited: bool = True):
         """Flush batch queue to database"""
-        async with self._batch_lock:
-            if not self._batch_queue:
-                return
-            
-            batch = self._batch_queue[:]
-            self._batch_queue.clear()
+        if not self._batch_queue and not self._pending_sessions:
+            return
         
+        if rate_limited:
+            # Write what the token bucket allows; the rest waits for the next flush
+            granted = self._write_bucket.take(len(self._batch_queue))
+            if not granted and not self._pending_sessions:
+                return  # Nothing writable yet; don't open an empty transaction
+            batch = self._batch_queue[:granted]
+            self._batch_queue = self._batch_queue[granted:]
+        else:
+            batch = self._batch_queue
+            self._batch_queue = []
+        sessions = self._pending_sessions
+        self._pending_sessions = {}
+        self._flush_idle.clear()
+        self._flush_count += 1
+        try:
+            await self._write_batch(batch, sessions)
+        finally:
+            self._flush_idle.set()
+    
+    async def _write_batch(self, batch: list, sessions: Dict[int, Optional[tuple]]):
+        """Write one flush's attempts and session changes in a single transaction"""
         # Group by type for efficient batch inserts
         attempts = [b for b in batch if b['type'] == 'attempt']
+        session_rows = [row for row in sessions.values() if row is not None]
+        session_deletes = [(user_id,) for user_id, row in sessions.items() if row is None]
         
-        if attempts:
-            await self.pool.executemany(
-                """INSERT INTO question_attempts 
-                   (user_telegram_id, question_id, language, is_correct, time_taken_seconds, attempted_at) 
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                [(a['user_telegram_id'], a['question_id'], a['language'], 
-                  a['is_correct'], a['time_taken_seconds'], a['timestamp']) for a in attempts]
-            )
-            
-            # Update user totals
-            user_updates = {}
-            for a in attempts:
-                user_id = a['user_telegram_id']
-                user_updates[user_id] = user_updates.get(user_id, 0) + 1
-            
-            for user_id, count in user_updates.items():
-                await self.pool.execute(
-                    "UPDATE users SET total_questions_answered = total_questions_answered + ? WHERE telegram_id = ?",
-                    (count, user_id)
+        # Update user totals
+        user_updates = {}
+        for a in attempts:
+            user_id = a['user_telegram_id']
+            user_updates[user_id] = user_updates.get(user_id, 0) + 1
+        
+        # Group commit: the whole batch shares a single transaction and fsync
+        async with self.pool.write_transaction() as conn:
+            if attempts:
+                await conn.executemany(
+                    SQL_INSERT_ATTEMPT,
+                    [(a['user_telegram_id'], a['question_id'], a['language'], 
+                      a['is_correct'], a['time_taken_seconds'], a['timestamp']) for a in attempts]
                 )
+            # One UPDATE for all users instead of one per user
+            deltas = list(user_updates.items())
+            for i in range(0, len(deltas), USER_TOTALS_CHUNK_SIZE):
+                chunk = deltas[i:i + USER_TOTALS_CHUNK_SIZE]
+                # Pad to a power of two so only a handful of distinct statements exist
+                # and each stays in the statement cache; NULL ids match no user
+                rows = 1 << (len(chunk) - 1).bit_length()
+                chunk += [(None, 0)] * (rows - len(chunk))
+                await conn.execute(_user_totals_sql(rows), [v for pair in chunk for v in pair])
+            if session_rows:
+                await conn.executemany(SQL_SAVE_SESSION, session_rows)
+            if session_deletes:
+                await conn.executemany(SQL_CLEAR_SESSION, session_deletes)
     
     async def get_user_statistics(self, telegram_id: int) -> Dict[str, Any]:
         """Get user statistics with optimized query"""
-        result = await self.pool.fetchone(
-            """SELECT 
-                COUNT(*) as total_attempts,
-                SUM(CASE WHEN is_correct THEN 1 ELSE 0 END) as correct_answers,
-                AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) * 100 as accuracy_percentage
-               FROM question_attempts 
-               WHERE user_telegram_id = ?""",
-            (telegram_id,)
-        )
+        while True:
+            await self._flush_idle.wait()
+            flushes = self._flush_count
+            result = await self.pool.fetchone(
+                SQL_USER_STATISTICS,
+                (telegram_id,)
+            )
+            # No flush ran during the read, so every attempt is in exactly one of
+            # the table and the queue
+            if self._flush_idle.is_set() and self._flush_count == flushes:
+                break
         
-        return dict(result) if result else {}
+        # Attempts still queued for the batch writer are not in the table yet
+        pending = [b['is_correct'] for b in self._batch_queue if b['user_telegram_id'] == telegram_id]
+        if pending and result is not None:
+            total = result['total_attempts'] + len(pending)
+            correct = (result['correct_answers'] or 0) + sum(pending)
+            result = {
+                'total_attempts': total,
+                'correct_answers': correct,
+                'accuracy_percentage': correct * 100.0 / total,
+            }
+        
+        return result or {}
     
     async def update_spaced_repetition(
         self,
@@ -230,46 +560,36 @@ class DatabaseManager:
         language: str,
         is_correct: bool
     ):
-        """Update spaced repetition data"""
-        sr_data = await self.pool.fetchone(
-            """SELECT * FROM spaced_repetition 
-               WHERE user_telegram_id = ? AND question_id = ? AND language = ?""",
-            (user_telegram_id, question_id, language)
+        """Update spaced repetition data with a single SM-2 upsert"""
+        now = _now_ms()
+        await self.pool.execute(
+            SQL_UPSERT_SPACED_REPETITION,
+            {
+                'user_id': user_telegram_id,
+                'question_id': question_id,
+                'language': language,
+                'is_correct': is_correct,
+                'next_review': now + DAY_MS,
+                'now': now,
+            }
         )
-        
-        if not sr_data:
-            next_review = datetime.now() + timedelta(days=1)
-            await self.pool.execute(
-                """INSERT INTO spaced_repetition 
-                   (user_telegram_id, question_id, language, next_review, last_reviewed) 
-                   VALUES (?, ?, ?, ?, ?)""",
-                (user_telegram_id, question_id, language, next_review, datetime.now())
-            )
-        else:
-            sr_dict = dict(sr_data)
-            ease_factor = sr_dict['ease_factor']
-            interval_days = sr_dict['interval_days']
-            repetition_count = sr_dict['repetition_count']
-            
-            if is_correct:
-                ease_factor = min(ease_factor + 0.1, 3.0)
-                interval_days = max(1, int(interval_days * ease_factor))
-                repetition_count += 1
-            else:
-                ease_factor = max(ease_factor - 0.2, 1.3)
-                interval_days = 1
-                repetition_count = 0
-            
-            next_review = datetime.now() + timedelta(days=interval_days)
-            
-            await self.pool.execute(
-                """UPDATE spaced_repetition 
-                   SET ease_factor = ?, interval_days = ?, repetition_count = ?, 
-                       next_review = ?, last_reviewed = ?
-                   WHERE user_telegram_id = ? AND question_id = ? AND language = ?""",
-                (ease_factor, interval_days, repetition_count, next_review, datetime.now(),
-                 user_telegram_id, question_id, language)
-            )
+    
+    async def record_answer(
+        self,
+        user_telegram_id: int,
+        question_id: str,
+        language: str,
+        is_correct: bool,
+        time_taken_seconds: Optional[int] = None
+    ):
+        """Record an answer: queue the attempt and apply the SM-2 update in one DB round trip"""
+        # The attempt is only an in-memory queue append; the upsert is the sole
+        # write awaited here. It stays synchronous so the next review lookup,
+        # issued right after, never serves the question just answered.
+        await self.record_question_attempt(
+            user_telegram_id, question_id, language, is_correct, time_taken_seconds
+        )
+        await self.update_spaced_repetition(user_telegram_id, question_id, language, is_correct)
     
     async def get_next_question_for_review(
         self, 
@@ -278,70 +598,116 @@ class DatabaseManager:
     ) -> Optional[str]:
         """Get next question for spaced repetition review"""
         result = await self.pool.fetchone(
-            """SELECT question_id FROM spaced_repetition 
-               WHERE user_telegram_id = ? AND language = ? AND next_review <= ?
-               ORDER BY next_review ASC LIMIT 1""",
-            (user_telegram_id, language, datetime.now())
+            SQL_NEXT_REVIEW,
+            (user_telegram_id, language, _now_ms())
         )
         
-        return dict(result)['question_id'] if result else None
+        return result['question_id'] if result else None
     
     async def get_attempted_questions(
         self, 
         user_telegram_id: int, 
         language: str
-    ) -> List[str]:
-        """Get list of attempted questions"""
-        results = await self.pool.fetchall(
-            """SELECT DISTINCT question_id FROM question_attempts 
-               WHERE user_telegram_id = ? AND language = ?
-               ORDER BY attempted_at DESC
-               LIMIT 1000""",  # Limit for performance
-            (user_telegram_id, language)
+    ) -> Set[str]:
+        """Get set of attempted questions, served from memory once loaded"""
+        key = (user_telegram_id, language)
+        attempted = self._attempted_cache.get(key)
+        if attempted is not None:
+            self._attempted_cache.move_to_end(key)
+            return attempted
+        
+        while True:
+            await self._flush_idle.wait()
+            flushes = self._flush_count
+            attempted = set(await self.pool.fetchall_column(
+                SQL_ATTEMPTED_QUESTIONS,
+                (user_telegram_id, language)
+            ))
+            # As in get_user_statistics: the set is cached for good, so it must not
+            # miss attempts a flush has taken off the queue but not committed
+            if self._flush_idle.is_set() and self._flush_count == flushes:
+                break
+        
+        # Attempts queued while the query ran are not in the result yet
+        attempted.update(
+            b['question_id'] for b in self._batch_queue
+            if b['user_telegram_id'] == user_telegram_id and b['language'] == language
         )
         
-        return [dict(r)['question_id'] for r in results]
+        self._attempted_cache[key] = attempted
+        if len(self._attempted_cache) > self.user_cache_size:
+            self._attempted_cache.popitem(last=False)  # Evict least recently used
+        
+        return attempted
     
     async def save_user_session(
         self,
         user_telegram_id: int,
         current_question_id: str,
         language: str,
-        question_start_time: Optional[datetime] = None,
+        question_start_time: Optional[int] = None,
         awaiting_answer: bool = True
     ):
-        """Save user session"""
-        await self.pool.execute(
-            """INSERT OR REPLACE INTO user_sessions 
-               (user_telegram_id, current_question_id, language, question_start_time, awaiting_answer, updated_at)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (user_telegram_id, current_question_id, language, question_start_time, awaiting_answer, datetime.now())
-        )
+        """Queue user session upsert; only the latest state per user is written"""
+        # question_start_time is unix epoch milliseconds, like every stored time
+        row = (user_telegram_id, current_question_id, language, question_start_time,
+               awaiting_answer, _now_ms())
+        self._queue_session(user_telegram_id, row)
     
     async def get_user_session(self, user_telegram_id: int) -> Optional[Dict[str, Any]]:
-        """Get user session"""
-        session = await self.pool.fetchone(
-            "SELECT * FROM user_sessions WHERE user_telegram_id = ?",
-            (user_telegram_id,)
-        )
+        """Get user session, preferring a not-yet-flushed pending write, then the session cache"""
+        # Both maps store None for "no session", so a sentinel marks a miss
+        row = self._pending_sessions.get(user_telegram_id, _MISSING)
+        if row is _MISSING:
+            row = self._session_cache.get(user_telegram_id, _MISSING)
+            if row is not _MISSING:
+                self._session_cache.move_to_end(user_telegram_id)
+        if row is _MISSING:
+            session = await self.pool.fetchone(
+                SQL_GET_SESSION,
+                (user_telegram_id,)
+            )
+            row = tuple(session[column] for column in SESSION_COLUMNS) if session else None
+            # A save or clear made while the query ran is newer; don't overwrite it
+            if user_telegram_id not in self._session_cache:
+                self._cache_session(user_telegram_id, row)
         
-        return dict(session) if session else None
+        return dict(zip(SESSION_COLUMNS, row)) if row is not None else None
     
     async def clear_user_session(self, user_telegram_id: int):
-        """Clear user session"""
-        await self.pool.execute(
-            "DELETE FROM user_sessions WHERE user_telegram_id = ?",
-            (user_telegram_id,)
-        )
+        """Queue user session delete"""
+        self._queue_session(user_telegram_id, None)
+    
+    def _queue_session(self, user_telegram_id: int, row: Optional[tuple]):
+        """Record the latest session state for the next batch flush"""
+        self._pending_sessions[user_telegram_id] = row
+        self._cache_session(user_telegram_id, row)
+        if len(self._batch_queue) + len(self._pending_sessions) >= self.batch_size:
+            self._batch_ready.set()
+    
+    def _cache_session(self, user_telegram_id: int, row: Optional[tuple]):
+        """Remember a user's session row, evicting the least recently used"""
+        self._session_cache[user_telegram_id] = row
+        self._session_cache.move_to_end(user_telegram_id)
+        if len(self._session_cache) > self.user_cache_size:
+            self._session_cache.popitem(last=False)
     
     async def get_all_active_sessions(self) -> List[Dict[str, Any]]:
         """Get all active sessions within last 24 hours"""
-        sessions = await self.pool.fetchall(
-            """SELECT * FROM user_sessions 
-               WHERE awaiting_answer = 1 
-               AND datetime(updated_at) > datetime('now', '-24 hours')
-               ORDER BY updated_at DESC
-               LIMIT 10000""",  # Limit for safety
-        )
+        # Compare against a bound cutoff so the index range scan applies
+        sessions = await self.pool.fetchall(SQL_ACTIVE_SESSIONS, (_now_ms() - DAY_MS,))
         
-        return [dict(s) for s in sessions]
\ No newline at end of file
+        return sessions
+    
+    async def get_media_file_ids(self) -> Dict[str, str]:
+        """Get every stored Telegram file_id, keyed by media path"""
+        rows = await self.pool.fetchall(SQL_MEDIA_FILE_IDS)
+        return {row['path']: row['file_id'] for row in rows}
+    
+    async def save_media_file_id(self, path: str, file_id: str, kind: str):
+        """Store the Telegram file_id of an uploaded video or photo"""
+        await self.pool.execute(SQL_SAVE_MEDIA_FILE_ID, (path, file_id, kind))
+    
+    async def delete_media_file_id(self, path: str):
+        """Forget a file_id Telegram no longer accepts"""
+        await self.pool.execute(SQL_DELETE_MEDIA_FILE_ID, (path,))
\ No newline at end of file
@@ -7,19 +7,41 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def dict_factory(cursor, row) -> dict:
+    """Build result rows directly as dicts, avoiding a Row-then-dict double conversion"""
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
 class DatabasePool:
     """
     Database connection pool for handling concurrent connections efficiently.
-    Uses multiple connections to handle thousands of concurrent users.
+    SQLite in WAL mode allows many concurrent readers but only one writer, so
+    the pool keeps a single dedicated write connection plus read-only readers.
     """
     
-    def __init__(self, db_path: str = "driving_theory_bot.db", pool_size: int = 10):
+    def __init__(
+        self,
+        db_path: str = "driving_theory_bot.db",
+        pool_size: int = 10,
+        cache_size: int = 64000,
+        cached_statements: int = 256,
+        optimize_interval: float = 3 * 3600,
+        checkpoint_interval: float = 300
+    ):
         self.db_path = db_path
         self.pool_size = pool_size
-        self._pool = []
-        self._used_connections = set()
-        self._lock = asyncio.Lock()
-        self._semaphore = asyncio.Semaphore(pool_size)
+        self.cached_statements = cached_statements  # Prepared statements kept per connection
+        self.read_pool_size = max(1, pool_size - 1)  # One slot is the writer
+        self.cache_size = cache_size  # Page cache per connection, in KiB
+        self._pool: Optional[asyncio.Queue] = None  # Idle reader connections
+        self._readers = []  # Every reader connection, for close()
+        self._lock = asyncio.Lock()  # Guards initialize() only
+        self._write_conn: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self.optimize_interval = optimize_interval  # Seconds between PRAGMA optimize runs
+        self._optimize_task = None
+        self.checkpoint_interval = checkpoint_interval  # Seconds between WAL truncations
+        self._checkpoint_task = None
         self._initialized = False
     
     async def initialize(self):
@@ -30,90 +52,191 @@ class DatabasePool:
         async with self._lock:
             if self._initialized:
                 return
+            
+            # The writer is created first so WAL mode is set before any reader opens
+            self._write_conn = await self._create_connection()
                 
-            # Create initial connections
-            for _ in range(min(3, self.pool_size)):  # Start with 3 connections
-                conn = await self._create_connection()
-                self._pool.append(conn)
+            # Open every reader up front, concurrently, so acquire is a pure queue pop
+            self._readers = list(await asyncio.gather(
+                *[self._create_connection(read_only=True) for _ in range(self.read_pool_size)]
+            ))
+            self._pool = asyncio.Queue(maxsize=self.read_pool_size)
+            for conn in self._readers:
+                self._pool.put_nowait(conn)
             
+            self._optimize_task = asyncio.create_task(self._optimize_periodically())
+            self._checkpoint_task = asyncio.create_task(self._checkpoint_periodically())
             self._initialized = True
-            logger.info(f"Database pool initialized with {len(self._pool)} connections")
+            logger.info(f"Database pool initialized with 1 writer and {len(self._readers)} reader connections")
     
-    async def _create_connection(self) -> aiosqlite.Connection:
+    async def _create_connection(self, read_only: bool = False) -> aiosqlite.Connection:
         """Create a new database connection with optimized settings"""
-        conn = await aiosqlite.connect(self.db_path)
-        conn.row_factory = aiosqlite.Row
+        # Writer's implicit transactions take the write lock at BEGIN, like write_transaction()
+        conn = await aiosqlite.connect(
+            self.db_path,
+            cached_statements=self.cached_statements,
+            isolation_level="DEFERRED" if read_only else "IMMEDIATE"
+        )
+        conn.row_factory = dict_factory
         
-        # Optimize for concurrent access
-        await conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging for better concurrency
-        await conn.execute("PRAGMA synchronous=NORMAL")  # Faster writes
-        await conn.execute("PRAGMA cache_size=10000")  # Larger cache for better performance
-        await conn.execute("PRAGMA temp_store=MEMORY")  # Use memory for temp tables
-        await conn.execute("PRAGMA mmap_size=30000000000")  # Memory-mapped I/O
+        # Optimize for concurrent access; sent as one script to save round trips
+        pragmas = [
+            "PRAGMA journal_mode=WAL",  # Write-Ahead Logging for better concurrency
+            "PRAGMA synchronous=NORMAL",  # Faster writes
+            f"PRAGMA cache_size=-{int(self.cache_size)}",  # Negative value is KiB, not pages
+            "PRAGMA temp_store=MEMORY",  # Use memory for temp tables
+            "PRAGMA mmap_size=268435456",  # 256 MiB memory-mapped I/O
+            "PRAGMA busy_timeout=5000",  # Wait on lock contention inside SQLite instead of failing
+        ]
+        if read_only:
+            pragmas.append("PRAGMA query_only=1")  # Guard against writes on reader connections
+        await conn.executescript(";\n".join(pragmas) + ";")
         
         return conn
     
     @asynccontextmanager
-    async def acquire(self):
-        """Acquire a connection from the pool"""
-        await self._semaphore.acquire()
-        conn = None
-        
+    async def acquire_read(self):
+        """Acquire a read-only connection from the pool"""
+        conn = await self._get_reader()
         try:
-            async with self._lock:
-                if self._pool:
-                    conn = self._pool.pop()
-                elif len(self._used_connections) < self.pool_size:
-                    conn = await self._create_connection()
-                else:
-                    # Wait for a connection to be released
-                    while not self._pool:
-                        await asyncio.sleep(0.01)
-                    conn = self._pool.pop()
-                
-                self._used_connections.add(conn)
-            
             yield conn
-            
         finally:
-            if conn:
-                async with self._lock:
-                    self._used_connections.discard(conn)
-                    self._pool.append(conn)
-            self._semaphore.release()
+            self._put_reader(conn)
+    
+    async def _get_reader(self) -> aiosqlite.Connection:
+        """Check out a reader; waiters are woken in FIFO order, no lock or polling"""
+        return await self._pool.get()
+    
+    def _put_reader(self, conn: aiosqlite.Connection):
+        """Return a reader checked out with _get_reader"""
+        self._pool.put_nowait(conn)
+    
+    @asynccontextmanager
+    async def acquire_write(self):
+        """Acquire the single write connection"""
+        async with self._write_lock:
+            yield self._write_conn
+    
+    @asynccontextmanager
+    async def write_transaction(self):
+        """Run a block of writes on the writer as one BEGIN IMMEDIATE ... COMMIT"""
+        async with self.acquire_write() as conn:
+            await conn.execute("BEGIN IMMEDIATE")  # Take the write lock up front
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+    
+    async def _optimize(self):
+        """Refresh planner statistics for any table that needs it"""
+        # 0x10002 checks every table, not only those this connection has queried;
+        # the writer runs few reads itself. Readers are query_only and cannot ANALYZE.
+        async with self.acquire_write() as conn:
+            await conn.execute("PRAGMA optimize=0x10002")
+    
+    async def _optimize_periodically(self):
+        """Keep statistics fresh for long-running processes"""
+        while True:
+            try:
+                await asyncio.sleep(self.optimize_interval)
+                await self._optimize()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error running PRAGMA optimize: {e}")
+    
+    async def _checkpoint_periodically(self):
+        """Fold the WAL back into the database and truncate it so reads don't scan a long log"""
+        while True:
+            try:
+                await asyncio.sleep(self.checkpoint_interval)
+                async with self.acquire_write() as conn:
+                    # Release free pages first (no-op unless auto_vacuum=INCREMENTAL).
+                    # It frees one page per step; executescript steps it to completion.
+                    await conn.executescript("PRAGMA incremental_vacuum(1000);")
+                    async with conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+                        result = await cursor.fetchone()
+                if result['busy']:
+                    logger.debug("WAL checkpoint could not finish; readers still active")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error checkpointing WAL: {e}")
     
     async def close(self):
         """Close all connections in the pool"""
         async with self._lock:
-            for conn in self._pool:
-                await conn.close()
-            for conn in self._used_connections:
+            for task in (self._optimize_task, self._checkpoint_task):
+                if task:
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+            self._optimize_task = self._checkpoint_task = None
+            
+            for conn in self._readers:
                 await conn.close()
             
-            self._pool.clear()
-            self._used_connections.clear()
+            if self._write_conn:
+                try:
+                    await self._optimize()  # Leave good statistics for the next process
+                except Exception as e:
+                    logger.error(f"Error running PRAGMA optimize: {e}")
+            
+            async with self._write_lock:
+                if self._write_conn:
+                    await self._write_conn.close()
+                    self._write_conn = None
+            
+            self._readers.clear()
+            self._pool = None
             self._initialized = False
     
     async def execute(self, query: str, params: tuple = ()):
-        """Execute a query using a connection from the pool"""
-        async with self.acquire() as conn:
+        """Execute a query on the write connection"""
+        async with self.acquire_write() as conn:
             await conn.execute(query, params)
             await conn.commit()
     
     async def executemany(self, query: str, params: list):
-        """Execute many queries using a connection from the pool"""
-        async with self.acquire() as conn:
+        """Execute many queries on the write connection as a single transaction"""
+        async with self.write_transaction() as conn:
             await conn.executemany(query, params)
+    
+    async def execute_fetchone(self, query: str, params: tuple = ()):
+        """Execute a write returning a row (e.g. RETURNING) on the write connection"""
+        async with self.acquire_write() as conn:
+            async with conn.execute(query, params) as cursor:
+                row = await cursor.fetchone()
             await conn.commit()
+            return row
     
     async def fetchone(self, query: str, params: tuple = ()):
-        """Fetch one result using a connection from the pool"""
-        async with self.acquire() as conn:
+        """Fetch one result using a reader connection from the pool"""
+        # Hot path: direct checkout instead of the acquire_read() context manager
+        conn = await self._get_reader()
+        try:
             async with conn.execute(query, params) as cursor:
                 return await cursor.fetchone()
+        finally:
+            self._put_reader(conn)
     
     async def fetchall(self, query: str, params: tuple = ()):
-        """Fetch all results using a connection from the pool"""
-        async with self.acquire() as conn:
+        """Fetch all results using a reader connection from the pool"""
+        conn = await self._get_reader()
+        try:
+            # Execute, fetch and close in one hop to the connection thread
+            return await conn.execute_fetchall(query, params)
+        finally:
+            self._put_reader(conn)
+    
+    async def fetchall_column(self, query: str, params: tuple = ()) -> list:
+        """Fetch the first column of every row, skipping dict construction"""
+        async with self.acquire_read() as conn:
             async with conn.execute(query, params) as cursor:
-                return await cursor.fetchall()
\ No newline at end of file
+                cursor.row_factory = None  # Plain tuples
+                rows = await cursor.fetchall()
+        return [r[0] for r in rows]
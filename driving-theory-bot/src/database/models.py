@@ -19,18 +19,17 @@ class QuestionAttempt:
     question_id: str
     language: str
     is_correct: bool
-    attempted_at: datetime
+    attempted_at: int  # Unix epoch milliseconds
     time_taken_seconds: Optional[int] = None
 
 
 @dataclass
 class SpacedRepetition:
-    id: Optional[int]
     user_telegram_id: int
     question_id: str
     language: str
     repetition_count: int
     ease_factor: float
     interval_days: int
-    next_review: datetime
-    last_reviewed: datetime
\ No newline at end of file
+    next_review: int  # Unix epoch milliseconds
+    last_reviewed: int  # Unix epoch milliseconds
\ No newline at end of file
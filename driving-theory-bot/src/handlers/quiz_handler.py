@@ -1,19 +1,97 @@
 import asyncio
+import hashlib
 import json
 import logging
-import random
-import re
-from datetime import datetime
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Optional, List, Set
+from typing import Dict, FrozenSet, List, Optional, Set
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from config import QUESTION_DELAY_SECONDS
+from database.db_manager import WriteQueueFullError
+from utils.keyed_lock import AsyncKeyedLock
 
 logger = logging.getLogger(__name__)
 
+# Media paths in the question data are relative to the repository root
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+
+# Fixed replies for /skip, /resend and the end of the question set
+MSG_SKIP_ACK = "⏭️ Question skipped. Loading next question..."
+MSG_SKIP_WAIT = (
+    "⏳ Please wait for the next question to be sent before using /skip.\n"
+    "You can use /stats to see your progress in the meantime."
+)
+MSG_SKIP_NONE = "No active question to skip. Use /start to begin."
+MSG_RESEND_NONE = "No active question to resend. Use /start to begin a new session."
+MSG_NO_MORE_QUESTIONS = "No more questions available."
+MSG_ANSWER_BUSY = (
+    "⚠️ The bot is busy right now and your answer wasn't saved.\n"
+    "Please send it again in a moment."
+)
+
+# Accepted replies to the language prompt, matched case-insensitively
+LANGUAGE_CHOICES = {
+    '1': 'english',
+    'english': 'english',
+    'e': 'english',
+    '2': 'deutsch',
+    'deutsch': 'deutsch',
+    'german': 'deutsch',
+    'd': 'deutsch',
+    '3': 'mixed',
+    'mixed': 'mixed',
+    'm': 'mixed'
+}
+
+# Media files ship with the question set and don't change at runtime, so
+# existence is checked once per path instead of a stat() per display
+_EXISTS_CACHE: Dict[str, bool] = {}
+
+
+def _media_exists(path: Path) -> bool:
+    """Memoized Path.exists() for question media"""
+    key = str(path)
+    exists = _EXISTS_CACHE.get(key)
+    if exists is None:
+        exists = _EXISTS_CACHE[key] = path.exists()
+        if not exists:
+            logger.error(f"Media file missing: {path}")
+    return exists
+
+
+def _question_id(question: Dict) -> str:
+    """Stable id for recording a question; hashes the text when the data has no id"""
+    return (
+        question.get('id') or question.get('question_id') or question.get('question_number')
+        or hashlib.blake2b(
+            (question.get('question_text') or question.get('question', '')).encode(), digest_size=8
+        ).hexdigest()
+    )
+
+
+def _discard_task(task: asyncio.Task):
+    """Cancel a task whose result is no longer wanted, or retrieve its error if it is done"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()  # Marks the error as retrieved, so asyncio doesn't log it
+
+
+class UserState:
+    """A user's current question, its language, when it was sent and whether an answer is expected"""
+    
+    __slots__ = ('question', 'language', 'start', 'awaiting')
+    
+    def __init__(self):
+        self.question: Optional[Dict] = None
+        self.language = 'english'  # Language the question was picked in
+        self.start: Optional[float] = None  # time.monotonic() when the question was sent
+        self.awaiting = False
+
 
 class QuizHandler:
     """
@@ -21,24 +99,110 @@ class QuizHandler:
     Designed for handling thousands of concurrent users with optimizations.
     """
     
-    def __init__(self, db_manager, question_loader):
+    def __init__(self, db_manager, question_loader, stats_cache_size: int = 10000):
         self.db = db_manager
         self.question_loader = question_loader
-        self.active_questions: Dict[int, Dict] = {}
-        self.question_start_times: Dict[int, datetime] = {}
-        self.awaiting_answer: Set[int] = set()
-        self._user_locks = {}  # Per-user locks to prevent race conditions
+        # One slotted entry per user with a current question, instead of three parallel dicts
+        self._state: Dict[int, UserState] = {}
+        self._user_locks = AsyncKeyedLock()  # Per-user locks to prevent race conditions
+        # LRU of per-user statistics, loaded once from the DB and then kept
+        # current in-process as answers are recorded
+        self._stats_cache: "OrderedDict[int, Dict]" = OrderedDict()
+        self.stats_cache_size = stats_cache_size
+        # Telegram file_id per media path relative to BASE_DIR; resending by id skips
+        # the disk read and upload. Bounded by the number of media files in the
+        # question set, and persisted so a restart doesn't upload everything again.
+        self._file_id_cache: Dict[str, str] = {}
+    
+    def _user_state(self, user_id: int) -> UserState:
+        """Get the user's state, creating an empty one if needed"""
+        state = self._state.get(user_id)
+        if state is None:
+            state = self._state[user_id] = UserState()
+        return state
     
-    async def _get_user_lock(self, user_id: int) -> asyncio.Lock:
-        """Get or create a lock for a specific user"""
-        if user_id not in self._user_locks:
-            self._user_locks[user_id] = asyncio.Lock()
-        return self._user_locks[user_id]
+    def _get_user_lock(self, user_id: int):
+        """Context manager holding the lock for a specific user"""
+        return self._user_locks.lock(user_id)
+    
+    async def _get_user_stats(self, user_id: int) -> Dict:
+        """Get user statistics, hitting the database only on a cache miss"""
+        stats = self._stats_cache.get(user_id)
+        if stats is not None:
+            self._stats_cache.move_to_end(user_id)
+            return stats
+        
+        result = await self.db.get_user_statistics(user_id)
+        stats = {
+            'total_attempts': result.get('total_attempts', 0) or 0,
+            'correct_answers': int(result.get('correct_answers', 0) or 0),
+            'accuracy_percentage': result.get('accuracy_percentage', 0) or 0,
+        }
+        self._stats_cache[user_id] = stats
+        if len(self._stats_cache) > self.stats_cache_size:
+            self._stats_cache.popitem(last=False)
+        return stats
+    
+    async def _media_input(self, media_path: str):
+        """Cached Telegram file_id for media_path, else its bytes read off the event loop"""
+        file_id = self._file_id_cache.get(media_path)
+        if file_id is not None:
+            return file_id
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, (BASE_DIR / media_path).read_bytes)
+    
+    async def _remember_file_id(self, media_path: str, sent, kind: str):
+        """Cache the file_id of media just sent, persisting it when it is new"""
+        # The media is already delivered, so a failure here is only logged
+        try:
+            # photo[-1] is the largest size
+            file_id = sent.video.file_id if kind == 'video' else sent.photo[-1].file_id
+            if self._file_id_cache.get(media_path) == file_id:
+                return
+            self._file_id_cache[media_path] = file_id
+            await self.db.save_media_file_id(media_path, file_id, kind)
+        except Exception as e:
+            logger.error(f"Error saving file_id for {media_path}: {e}")
+    
+    async def _forget_file_id(self, media_path: str):
+        """Drop a file_id that failed to send, so the next send uploads again"""
+        if self._file_id_cache.pop(media_path, None) is None:
+            return
+        try:
+            await self.db.delete_media_file_id(media_path)
+        except Exception as e:
+            logger.error(f"Error deleting file_id for {media_path}: {e}")
+    
+    async def load_media_cache(self):
+        """Load Telegram file_ids stored by previous runs"""
+        try:
+            self._file_id_cache.update(await self.db.get_media_file_ids())
+            logger.info(f"Loaded {len(self._file_id_cache)} cached media file_ids")
+        except Exception as e:
+            logger.error(f"Error loading media file_ids: {e}")
+    
+    def _count_answer(self, stats: Dict, is_correct: bool):
+        """Fold a just-recorded answer into cached statistics"""
+        stats['total_attempts'] += 1
+        stats['correct_answers'] += int(is_correct)
+        stats['accuracy_percentage'] = stats['correct_answers'] * 100.0 / stats['total_attempts']
     
     async def restore_sessions(self):
         """Restore active sessions from database on bot restart"""
         try:
             sessions = await self.db.get_all_active_sessions()
+            self._stats_cache.clear()
+            
+            # One bulk lookup per language instead of one per session
+            ids_by_language: Dict[str, Set[str]] = {}
+            for session in sessions:
+                if session.get('current_question_id'):
+                    ids_by_language.setdefault(session.get('language', 'english'), set()).add(session['current_question_id'])
+            questions_by_language = {
+                language: await self.question_loader.get_questions_by_ids(ids, language)
+                for language, ids in ids_by_language.items()
+            }
+            
             for session in sessions:
                 user_id = session['user_telegram_id']
                 question_id = session.get('current_question_id')
@@ -46,13 +210,16 @@ class QuizHandler:
                 
                 if question_id:
                     # Look up the actual question by ID
-                    question = await self.question_loader.get_question_by_id(question_id, language)
+                    question = questions_by_language[language].get(question_id)
                     if question:
-                        self.active_questions[user_id] = question
+                        state = self._user_state(user_id)
+                        state.question = question
+                        state.language = language
                         if session['question_start_time']:
-                            self.question_start_times[user_id] = datetime.fromisoformat(session['question_start_time'])
-                        if session['awaiting_answer']:
-                            self.awaiting_answer.add(user_id)
+                            # Stored as wall-clock epoch ms; rebase it onto this process's monotonic clock
+                            elapsed = time.time() - session['question_start_time'] / 1000
+                            state.start = time.monotonic() - elapsed
+                        state.awaiting = bool(session['awaiting_answer'])
                     else:
                         logger.warning(f"Could not find question {question_id} for user {user_id}")
             
@@ -64,10 +231,9 @@ class QuizHandler:
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user = update.effective_user
-        user_lock = await self._get_user_lock(user.id)
-        
-        async with user_lock:
+        async with self._get_user_lock(user.id):
             await self.db.get_or_create_user(user.id, user.username)
+            self._stats_cache.pop(user.id, None)  # Reload from the database on next use
             
             # Simple text-based language selection
             await update.message.reply_text(
@@ -85,16 +251,15 @@ class QuizHandler:
         user_id = update.effective_user.id
         text = update.message.text.strip()
         
-        user_lock = await self._get_user_lock(user_id)
-        
-        async with user_lock:
+        async with self._get_user_lock(user_id):
             # Handle language selection
             if context.user_data.get('awaiting_language'):
                 await self.handle_language_selection(update, context, text)
                 return
             
             # Handle quiz answers
-            if user_id in self.awaiting_answer:
+            state = self._state.get(user_id)
+            if state is not None and state.awaiting:
                 await self.handle_answer(update, context, text)
                 return
             
@@ -108,8 +273,12 @@ class QuizHandler:
                 if question_id:
                     question = await self.question_loader.get_question_by_id(question_id, language)
                     if question:
-                        self.active_questions[user_id] = question
-                        self.awaiting_answer.add(user_id)
+                        # Reuse the entry looked up above instead of probing again
+                        if state is None:
+                            state = self._state[user_id] = UserState()
+                        state.question = question
+                        state.language = language
+                        state.awaiting = True
                         context.user_data['language'] = language
                         
                         await update.message.reply_text(
@@ -126,8 +295,12 @@ class QuizHandler:
     
     async def _get_next_question(self, user_id: int, language: str):
         """Get the next question without displaying it"""
-        # Check for spaced repetition review
-        review_question_id = await self.db.get_next_question_for_review(user_id, language)
+        # The review lookup and attempted set are independent reads; run them on
+        # separate reader connections so a miss on review costs no extra round trip
+        review_question_id, attempted_questions = await asyncio.gather(
+            self.db.get_next_question_for_review(user_id, language),
+            self.db.get_attempted_questions(user_id, language)
+        )
         
         if review_question_id:
             question = await self.question_loader.get_question_by_id(review_question_id, language)
@@ -136,7 +309,6 @@ class QuizHandler:
                 return question
         
         # Get random question
-        attempted_questions = await self.db.get_attempted_questions(user_id, language)
         question = await self.question_loader.get_random_question(language, attempted_questions, user_id)
         if question:
             question['is_review'] = False
@@ -146,20 +318,7 @@ class QuizHandler:
         """Handle language selection"""
         user_id = update.effective_user.id
         
-        language_map = {
-            '1': 'english',
-            'english': 'english',
-            'e': 'english',
-            '2': 'deutsch',
-            'deutsch': 'deutsch',
-            'german': 'deutsch',
-            'd': 'deutsch',
-            '3': 'mixed',
-            'mixed': 'mixed',
-            'm': 'mixed'
-        }
-        
-        language = language_map.get(text.lower())
+        language = LANGUAGE_CHOICES.get(text.lower())
         
         if not language:
             await update.message.reply_text(
@@ -184,10 +343,13 @@ class QuizHandler:
         
         await self.send_next_question(update.message, user_id, language)
     
-    async def send_next_question(self, message, user_id: int, language: str):
-        """Send the next question to user"""
+    async def send_next_question(self, message, user_id: int, language: str, next_question_task: Optional[asyncio.Task] = None):
+        """Send the next question to user, optionally one already being picked by next_question_task"""
         # Use the _get_next_question method for consistency
-        question = await self._get_next_question(user_id, language)
+        if next_question_task is None:
+            question = await self._get_next_question(user_id, language)
+        else:
+            question = await next_question_task
         
         if not question:
             await message.reply_text("No questions available. Please check your question files.")
@@ -197,23 +359,11 @@ class QuizHandler:
         if question.get('is_review'):
             await message.reply_text("📚 Time for review! This question is due for spaced repetition.")
         
-        self.active_questions[user_id] = question
-        self.question_start_times[user_id] = datetime.now()
-        self.awaiting_answer.add(user_id)
-        
-        # Save session to database
-        question_id = question.get('id') or question.get('question_id') or question.get('question_number', '')
-        await self.db.save_user_session(
-            user_id,
-            question_id,
-            language,
-            datetime.now(),
-            True
-        )
+        await self._activate_question(user_id, question, language)
         
         # Check for donation reminder
-        user_stats = await self.db.get_user_statistics(user_id)
-        total_attempts = user_stats.get('total_attempts', 0)
+        user_stats = await self._get_user_stats(user_id)
+        total_attempts = user_stats['total_attempts']
         
         if total_attempts > 0 and total_attempts % 100 == 0:
             await message.reply_text(
@@ -224,8 +374,23 @@ class QuizHandler:
         
         await self._display_question(message, question)
     
-    async def _display_question(self, message, question: Dict):
-        """Display a question to the user with full media support"""
+    async def _activate_question(self, user_id: int, question: Dict, language: str):
+        """Make question the user's current question and save the session"""
+        state = self._user_state(user_id)
+        state.question = question
+        state.language = language
+        state.start = time.monotonic()
+        state.awaiting = True
+        
+        # Only queued here; the batch writer persists it off the request path
+        await self.db.save_user_session(user_id, _question_id(question), language, int(time.time() * 1000), True)
+    
+    def _render_question(self, question: Dict) -> Dict[str, str]:
+        """Static display strings for a question, built once and cached on the question dict"""
+        render = question.get('_render')
+        if render is not None:
+            return render
+        
         # Build header with metadata
         header_parts = []
         
@@ -242,22 +407,62 @@ class QuizHandler:
         if question.get('points'):
             header_parts.append(f"⭐ {question['points']}")
         
-        if question.get('is_review'):
-            header_parts.append("🔄 Review Question")
-        
-        header = "\n".join(header_parts)
-        
         # Get question text (handle different field names)
         question_content = question.get('question_text') or question.get('question', 'No question text')
         question_text = f"❓ {question_content}"
         
-        if header:
-            full_text = f"{header}\n\n{question_text}"
+        # Review questions get one extra header line; both variants are kept
+        texts = []
+        for extra in ([], ["🔄 Review Question"]):
+            header = "\n".join(header_parts + extra)
+            texts.append(f"{header}\n\n{question_text}" if header else question_text)
+        
+        # Options block or input prompt based on question type
+        options = question.get('options', [])
+        
+        if options:
+            # Multiple choice question
+            options_text = "\n"
+            for i, option in enumerate(options):
+                letter = chr(65 + i)  # A, B, C, etc.
+                options_text += f"{letter}. {option}\n"
+            
+            options_text += "\n📝 Reply with your answer(s) (e.g., A or AB or A,B or A B)"
+            options_text += "\n⏭️ Use /skip to skip this question"
+            prompt = options_text
         else:
-            full_text = question_text
+            # Fill-in-the-blank question
+            prompt = (
+                "✍️ Type your answer directly (number or text)\n"
+                "⏭️ Use /skip to skip this question"
+            )
+        
+        render = question['_render'] = {'text': texts[0], 'review_text': texts[1], 'prompt': prompt}
+        return render
+    
+    def _correct_indices(self, question: Dict) -> FrozenSet[int]:
+        """Indices of the correct options, computed once and cached on the question dict"""
+        correct_indices = question.get('_correct_idx')
+        if correct_indices is not None:
+            return correct_indices
+        
+        # Get correct answers
+        correct_answers = question.get('correctAnswers', question.get('correctAnswer', []))
+        if not isinstance(correct_answers, list):
+            correct_answers = [correct_answers]
+        
+        correct_set = frozenset(correct_answers)
+        correct_indices = question['_correct_idx'] = frozenset(
+            i for i, option in enumerate(question.get('options', [])) if option in correct_set
+        )
+        return correct_indices
+    
+    async def _display_question(self, message, question: Dict):
+        """Display a question to the user with full media support"""
+        render = self._render_question(question)
+        full_text = render['review_text'] if question.get('is_review') else render['text']
         
         # Handle media (both video and image if available)
-        base_dir = Path(__file__).parent.parent.parent.parent
         media_sent = False
         
         # Get video and image paths from the question data
@@ -277,141 +482,95 @@ class QuizHandler:
             image_path = question['image']
         
         # Check if we have both video and image
-        has_video = video_path and (base_dir / video_path).exists()
-        has_image = image_path and (base_dir / image_path).exists()
-        
-        # Debug logging
-        logger.info(f"=== MEDIA DEBUG for question {question.get('question_id', 'unknown')} ===")
-        logger.info(f"Question keys: {list(question.keys())}")
-        logger.info(f"Base directory: {base_dir}")
-        
-        if 'local_video_paths' in question:
-            logger.info(f"local_video_paths: {question['local_video_paths']}")
-        if 'local_image_paths' in question:
-            logger.info(f"local_image_paths: {question['local_image_paths']}")
-            
-        logger.info(f"Detected video_path: {video_path}")
-        logger.info(f"Detected image_path: {image_path}")
-        
-        if video_path:
-            full_vid_path = base_dir / video_path
-            logger.info(f"Full video path: {full_vid_path}")
-            logger.info(f"Video exists: {full_vid_path.exists()}")
-            if not full_vid_path.exists():
-                logger.error(f"Video file missing: {full_vid_path}")
-                
-        if image_path:
-            full_img_path = base_dir / image_path
-            logger.info(f"Full image path: {full_img_path}")
-            logger.info(f"Image exists: {full_img_path.exists()}")
-            if not full_img_path.exists():
-                logger.error(f"Image file missing: {full_img_path}")
-                
-        logger.info(f"has_video: {has_video}, has_image: {has_image}")
-        logger.info("=== END MEDIA DEBUG ===")
+        has_video = video_path and _media_exists(BASE_DIR / video_path)
+        has_image = image_path and _media_exists(BASE_DIR / image_path)
+        
+        # Lazily formatted, so nothing is built unless DEBUG is enabled
+        logger.debug(
+            "Media for question %s: video=%s (found: %s), image=%s (found: %s)",
+            question.get('question_id', 'unknown'), video_path, bool(has_video), image_path, bool(has_image)
+        )
         
         if has_video:
             # Only video available
-            full_video_path = base_dir / video_path
             try:
-                with open(full_video_path, 'rb') as vid:
-                    await message.reply_video(
-                        video=vid,
-                        caption=full_text,
-                        supports_streaming=True
-                    )
-                media_sent = True
+                sent = await message.reply_video(
+                    video=await self._media_input(video_path),
+                    filename=Path(video_path).name,
+                    caption=full_text,
+                    supports_streaming=True
+                )
             except Exception as e:
+                await self._forget_file_id(video_path)  # Re-upload next time
                 logger.error(f"Error sending video: {e}")
                 await message.reply_text(full_text + f"\n\n[Video: {video_path}]")
-                media_sent = True
+            else:
+                # Outside the try, so a bookkeeping error can't trigger the text fallback too
+                await self._remember_file_id(video_path, sent, 'video')
+            media_sent = True
         
         elif has_image:
             # Only image available
-            full_image_path = base_dir / image_path
             try:
-                with open(full_image_path, 'rb') as img:
-                    await message.reply_photo(
-                        photo=img,
-                        caption=full_text
-                    )
-                media_sent = True
+                sent = await message.reply_photo(
+                    photo=await self._media_input(image_path),
+                    filename=Path(image_path).name,
+                    caption=full_text
+                )
             except Exception as e:
+                await self._forget_file_id(image_path)  # Re-upload next time
                 logger.error(f"Error sending image: {e}")
                 await message.reply_text(full_text + f"\n\n[Image: {image_path}]")
-                media_sent = True
+            else:
+                # Outside the try, so a bookkeeping error can't trigger the text fallback too
+                await self._remember_file_id(image_path, sent, 'photo')
+            media_sent = True
         
         # If no media was sent, just send text
         if not media_sent:
             await message.reply_text(full_text)
         
         # Display options or input prompt based on question type
-        options = question.get('options', [])
-        
-        if options:
-            # Multiple choice question
-            options_text = "\n"
-            for i, option in enumerate(options):
-                letter = chr(65 + i)  # A, B, C, etc.
-                options_text += f"{letter}. {option}\n"
-            
-            options_text += "\n📝 Reply with your answer(s) (e.g., A or AB or A,B or A B)"
-            options_text += "\n⏭️ Use /skip to skip this question"
-            
-            await message.reply_text(options_text)
-        else:
-            # Fill-in-the-blank question
-            await message.reply_text(
-                "✍️ Type your answer directly (number or text)\n"
-                "⏭️ Use /skip to skip this question"
-            )
+        await message.reply_text(render['prompt'])
     
-    def parse_answer_text(self, text: str) -> Optional[List[int]]:
-        """Parse user input to extract answer indices"""
-        text = text.upper().strip()
-        
-        # Check for skip
-        if text.lower() == 'skip':
-            return None
-        
-        # Remove all non-letter characters
-        letters = re.findall(r'[A-Z]', text)
-        
-        # Convert letters to indices (A=0, B=1, etc.)
+    def parse_answer_text(self, text: str) -> List[int]:
+        """Parse upper-cased user input to extract answer indices"""
+        # One pass over the bytes (non-ASCII is dropped by the encode): keep A-Z as
+        # indices (A=0, B=1, etc.) in order, deduplicated with a bitmask of seen letters
+        seen = 0
         indices = []
-        for letter in letters:
-            index = ord(letter) - ord('A')
-            if index >= 0 and index < 26:  # Valid letter range
+        for byte in text.encode('ascii', 'ignore'):
+            index = byte - 65
+            if 0 <= index < 26 and not seen >> index & 1:
+                seen |= 1 << index
                 indices.append(index)
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_indices = []
-        for idx in indices:
-            if idx not in seen:
-                seen.add(idx)
-                unique_indices.append(idx)
-        
-        return unique_indices
+        return indices
     
     async def handle_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
         """Handle user's answer"""
         user_id = update.effective_user.id
         
-        # Remove user from awaiting set
-        if user_id in self.awaiting_answer:
-            self.awaiting_answer.remove(user_id)
-        
-        question = self.active_questions.get(user_id)
+        state = self._state.get(user_id)
+        question = None
+        if state is not None:
+            state.awaiting = False  # No longer awaiting while this answer is handled
+            question = state.question
         if not question:
             await update.message.reply_text("No active question found. Use /start to begin.")
             return
         
+        # Case-fold once; the upper-cased text is both the skip check and the parser input
+        upper = text.upper()
+        
         # Handle skip
-        if text.lower() == 'skip':
-            await update.message.reply_text("Question skipped. Loading next question...")
-            language = context.user_data.get('language', 'english')
-            await self.send_next_question(update.message, user_id, language)
+        if upper == 'SKIP':
+            # Pick the next question while the acknowledgement is sent
+            next_question_task = asyncio.create_task(self._get_next_question(user_id, state.language))
+            try:
+                await update.message.reply_text("Question skipped. Loading next question...")
+                await self.send_next_question(update.message, user_id, state.language, next_question_task)
+            finally:
+                _discard_task(next_question_task)  # If the acknowledgement failed
             return
         
         # Check if this is a multiple choice or fill-in-the-blank question
@@ -419,13 +578,7 @@ class QuizHandler:
         
         if options:
             # Multiple choice question
-            selected_indices = self.parse_answer_text(text)
-            
-            if selected_indices is None:
-                await update.message.reply_text("Question skipped. Loading next question...")
-                language = context.user_data.get('language', 'english')
-                await self.send_next_question(update.message, user_id, language)
-                return
+            selected_indices = self.parse_answer_text(upper)
             
             # Validate answer indices
             num_options = len(options)
@@ -436,7 +589,7 @@ class QuizHandler:
                     "Invalid answer. Please reply with letter(s) like A, BC, or A,B,C\n"
                     "Try again or type 'skip' to skip this question."
                 )
-                self.awaiting_answer.add(user_id)  # Re-add to awaiting
+                state.awaiting = True  # Re-add to awaiting
                 return
             
             await self._process_answer(update, user_id, selected_indices, question, context)
@@ -446,104 +599,16 @@ class QuizHandler:
     
     async def _process_answer(self, update, user_id: int, selected_indices: list, question: Dict, context: ContextTypes.DEFAULT_TYPE):
         """Process user's answer"""
-        # Get correct answers
-        correct_answers = question.get('correctAnswers', question.get('correctAnswer', []))
-        if not isinstance(correct_answers, list):
-            correct_answers = [correct_answers]
-        
-        # Find correct indices
-        correct_indices = []
-        options = question.get('options', [])
-        for i, option in enumerate(options):
-            if option in correct_answers:
-                correct_indices.append(i)
+        correct_indices = self._correct_indices(question)
         
         # Check if answer is correct
-        is_correct = set(selected_indices) == set(correct_indices)
+        is_correct = frozenset(selected_indices) == correct_indices
         
-        # Calculate time taken
-        time_taken = None
-        if user_id in self.question_start_times:
-            time_taken = int((datetime.now() - self.question_start_times[user_id]).total_seconds())
-            del self.question_start_times[user_id]
-        
-        # Record attempt
-        language = context.user_data.get('language', 'english')
-        question_id = question.get('id', str(random.randint(1000, 9999)))
-        
-        await self.db.record_question_attempt(
-            user_id, question_id, language, is_correct, time_taken
-        )
-        
-        await self.db.update_spaced_repetition(
-            user_id, question_id, language, is_correct
+        await self._finish_answer(
+            update, user_id, question, is_correct,
+            ', '.join(chr(65 + i) for i in selected_indices),
+            ', '.join(chr(65 + i) for i in sorted(correct_indices))
         )
-        
-        # Flush batch writes to ensure stats are current
-        await self.db._flush_batch()
-        
-        # Prepare response
-        if is_correct:
-            response = "✅ Correct! Well done!"
-            if question.get('explanation'):
-                response += f"\n\n💡 {question['explanation']}"
-        else:
-            correct_letters = [chr(65 + i) for i in correct_indices]
-            selected_letters = [chr(65 + i) for i in selected_indices]
-            response = f"❌ Incorrect.\n"
-            response += f"Your answer: {', '.join(selected_letters)}\n"
-            response += f"Correct answer: {', '.join(correct_letters)}"
-            
-            if question.get('explanation'):
-                response += f"\n\n💡 {question['explanation']}"
-        
-        # Add statistics (fetch AFTER recording this attempt)
-        stats = await self.db.get_user_statistics(user_id)
-        accuracy = stats.get('accuracy_percentage', 0) or 0
-        total = stats.get('total_attempts', 0)
-        
-        response += f"\n\n📊 Your stats: {total} questions, {accuracy:.1f}% accuracy"
-        
-        await update.message.reply_text(response)
-        
-        # Clean up
-        if user_id in self.active_questions:
-            del self.active_questions[user_id]
-        
-        # Clear session from database
-        await self.db.clear_user_session(user_id)
-        
-        # Pick the next question NOW (before waiting)
-        next_question = await self._get_next_question(user_id, language)
-        
-        if next_question:
-            # Store the next question immediately
-            self.active_questions[user_id] = next_question
-            self.question_start_times[user_id] = datetime.now()
-            self.awaiting_answer.add(user_id)
-            
-            # Save session with the next question
-            await self.db.save_user_session(
-                user_id,
-                next_question.get('id') or next_question.get('question_id') or next_question.get('question_number', ''),
-                language,
-                datetime.now(),
-                True
-            )
-            
-            # NOW wait before sending next question
-            await update.message.reply_text(f"⏳ Next question in {QUESTION_DELAY_SECONDS} seconds...")
-            await asyncio.sleep(QUESTION_DELAY_SECONDS)
-            
-            # Display the already-selected question
-            await self._display_question(update.message, next_question)
-        else:
-            await update.message.reply_text("No more questions available.")
-        
-        # Clean up user lock if no longer needed
-        if user_id in self._user_locks and len(self._user_locks) > 1000:
-            # Clean up old locks to prevent memory leak
-            del self._user_locks[user_id]
     
     async def _process_text_answer(self, update, user_id: int, user_answer: str, question: Dict, context: ContextTypes.DEFAULT_TYPE):
         """Process fill-in-the-blank text answers"""
@@ -585,98 +650,108 @@ class QuizHandler:
                 is_correct = True
                 break
         
-        # Calculate time taken
-        time_taken = None
-        if user_id in self.question_start_times:
-            time_taken = int((datetime.now() - self.question_start_times[user_id]).total_seconds())
-            del self.question_start_times[user_id]
-        
-        # Record attempt
-        language = context.user_data.get('language', 'english')
-        question_id = question.get('id', str(random.randint(1000, 9999)))
-        
-        await self.db.record_question_attempt(
-            user_id, question_id, language, is_correct, time_taken
-        )
+        await self._finish_answer(update, user_id, question, is_correct, user_answer, correct_answer_text)
+    
+    async def _finish_answer(
+        self, update, user_id: int, question: Dict, is_correct: bool,
+        user_answer: str, correct_answer: str
+    ):
+        """Record a checked answer, send the result and move on to the next question"""
+        # Calculate time taken; handle_answer only gets here with a current question
+        state = self._state[user_id]
+        time_taken = int(time.monotonic() - state.start) if state.start is not None else None
+        
+        # Record attempt in the language the question was picked in
+        language = state.language
+        question_id = _question_id(question)
+        
+        # Load statistics before this attempt is recorded, then count it in-process
+        stats = await self._get_user_stats(user_id)
         
-        await self.db.update_spaced_repetition(
-            user_id, question_id, language, is_correct
-        )
+        try:
+            await self.db.record_answer(
+                user_id, question_id, language, is_correct, time_taken
+            )
+        except WriteQueueFullError:
+            # Nothing was recorded; keep the question open so the answer can be resent
+            state.awaiting = True
+            await update.message.reply_text(MSG_ANSWER_BUSY)
+            return
+        state.start = None
         
-        # Flush batch writes to ensure stats are current
-        await self.db._flush_batch()
+        # Left to the batch writer; stats are counted in-process
+        self._count_answer(stats, is_correct)
         
         # Prepare response
         if is_correct:
             response = "✅ Correct! Well done!"
-            if question.get('explanation'):
-                response += f"\n\n💡 {question['explanation']}"
         else:
             response = f"❌ Incorrect.\n"
             response += f"Your answer: {user_answer}\n"
-            response += f"Correct answer: {correct_answer_text}"
-            
-            if question.get('explanation'):
-                response += f"\n\n💡 {question['explanation']}"
-        
-        # Add statistics (fetch AFTER recording this attempt)
-        stats = await self.db.get_user_statistics(user_id)
-        accuracy = stats.get('accuracy_percentage', 0) or 0
-        total = stats.get('total_attempts', 0)
-        
-        response += f"\n\n📊 Your stats: {total} questions, {accuracy:.1f}% accuracy"
+            response += f"Correct answer: {correct_answer}"
         
-        await update.message.reply_text(response)
+        if question.get('explanation'):
+            response += f"\n\n💡 {question['explanation']}"
         
-        # Clean up current question
-        if user_id in self.active_questions:
-            del self.active_questions[user_id]
+        # Add statistics (already include this attempt)
+        accuracy = stats['accuracy_percentage']
+        total = stats['total_attempts']
         
-        # Clear current session
-        await self.db.clear_user_session(user_id)
+        response += f"\n\n📊 Your stats: {total} questions, {accuracy:.1f}% accuracy"
         
-        # Pick the next question NOW (before waiting)
-        next_question = await self._get_next_question(user_id, language)
+        # Start picking the next question now so it overlaps sending the result
+        next_question_task = asyncio.create_task(self._get_next_question(user_id, language))
+        try:
+            await update.message.reply_text(response)
+            
+            # Clean up
+            self._state.pop(user_id, None)
+            
+            # Clear session from database
+            await self.db.clear_user_session(user_id)
+            
+            # Next question was being picked while the result was sent
+            next_question = await next_question_task
+        finally:
+            _discard_task(next_question_task)  # If a send failed before the await
         
         if next_question:
             # Store the next question immediately
-            self.active_questions[user_id] = next_question
-            self.question_start_times[user_id] = datetime.now()
-            self.awaiting_answer.add(user_id)
+            await self._activate_question(user_id, next_question, language)
             
-            # Save session with the next question
-            await self.db.save_user_session(
-                user_id,
-                next_question.get('id') or next_question.get('question_id') or next_question.get('question_number', ''),
-                language,
-                datetime.now(),
-                True
+            # NOW wait before sending next question; the delay runs while the notice is
+            # sent, so the pause isn't lengthened by that round trip
+            await asyncio.gather(
+                update.message.reply_text(f"⏳ Next question in {QUESTION_DELAY_SECONDS} seconds..."),
+                asyncio.sleep(QUESTION_DELAY_SECONDS)
             )
             
-            # NOW wait before sending next question
-            await update.message.reply_text(f"⏳ Next question in {QUESTION_DELAY_SECONDS} seconds...")
-            await asyncio.sleep(QUESTION_DELAY_SECONDS)
-            
             # Display the already-selected question
             await self._display_question(update.message, next_question)
         else:
-            await update.message.reply_text("No more questions available.")
-        
-        # Clean up user lock if no longer needed
-        if user_id in self._user_locks and user_id not in self.active_questions:
-            # Clean up old locks to prevent memory leak
-            del self._user_locks[user_id]
+            await update.message.reply_text(MSG_NO_MORE_QUESTIONS)
     
     async def handle_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stats command - now works during wait periods"""
         user_id = update.effective_user.id
         
         # Don't use user lock for stats to avoid blocking during wait periods
-        stats = await self.db.get_user_statistics(user_id)
+        state = self._state.get(user_id)
+        current_question = state.question if state is not None else None
+        session = None
+        if current_question:
+            # Common case: statistics come from the in-process cache, no database read
+            stats = await self._get_user_stats(user_id)
+        else:
+            # No question in memory; the statistics and saved-session reads are independent
+            stats, session = await asyncio.gather(
+                self._get_user_stats(user_id),
+                self.db.get_user_session(user_id)
+            )
         
-        total = stats.get('total_attempts', 0)
-        correct = stats.get('correct_answers', 0) or 0
-        accuracy = stats.get('accuracy_percentage', 0) or 0
+        total = stats['total_attempts']
+        correct = stats['correct_answers']
+        accuracy = stats['accuracy_percentage']
         
         # Build stats message
         stats_text = (
@@ -687,7 +762,6 @@ class QuizHandler:
         )
         
         # Add current question info if available
-        current_question = self.active_questions.get(user_id)
         if current_question:
             stats_text += f"\n\n🔄 Current Question: {current_question.get('id', 'Unknown')}"
             if current_question.get('theme_name'):
@@ -698,90 +772,93 @@ class QuizHandler:
                 stats_text += f"\n⭐ Points: {current_question['points']}"
             
             # Show waiting status if user is not awaiting answer
-            if user_id not in self.awaiting_answer:
+            if not state.awaiting:
                 stats_text += f"\n⏳ Status: Waiting for next question"
         else:
-            # Check if there's a session in the database
-            session = await self.db.get_user_session(user_id)
+            # Fall back to the session saved in the database
             if session and session.get('current_question_id'):
                 stats_text += f"\n\n🔄 Current Question: {session['current_question_id']}"
                 stats_text += f"\n🌐 Language: {session.get('language', 'english').capitalize()}"
         
         await update.message.reply_text(stats_text)
     
+    async def _ensure_active_question(
+        self, user_id: int, context: ContextTypes.DEFAULT_TYPE, mark_awaiting: bool = False
+    ) -> Optional[UserState]:
+        """User's state with a current question, restored from the saved session if needed"""
+        state = self._state.get(user_id)
+        if state is not None and state.question:
+            return state
+        
+        # One read at most: the session comes from the pending write or session cache
+        # when known, and the question from the loader's in-memory index
+        session = await self.db.get_user_session(user_id)
+        if not session or not session.get('current_question_id'):
+            return None
+        language = session.get('language', 'english')
+        question = await self.question_loader.get_question_by_id(session['current_question_id'], language)
+        if not question:
+            return None
+        
+        # Reuse the entry looked up above instead of probing again
+        if state is None:
+            state = self._state[user_id] = UserState()
+        state.question = question
+        state.language = language
+        if mark_awaiting:
+            state.awaiting = True
+        context.user_data['language'] = language
+        return state
+    
     async def handle_resend(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Resend the current question"""
         user_id = update.effective_user.id
-        user_lock = await self._get_user_lock(user_id)
+        async with self._get_user_lock(user_id):
+            # Check if user has an active question, else restore the saved session
+            state = await self._ensure_active_question(user_id, context, mark_awaiting=True)
+            question = state.question if state is not None else None
         
-        async with user_lock:
-            # Check if user has an active question
-            question = self.active_questions.get(user_id)
-            
-            if not question:
-                # Check database for saved session
-                session = await self.db.get_user_session(user_id)
-                if session:
-                    question_id = session.get('current_question_id')
-                    language = session.get('language', 'english')
-                    if question_id:
-                        question_data = await self.question_loader.get_question_by_id(question_id, language)
-                        if question_data:
-                            # Restore to active questions
-                            self.active_questions[user_id] = question_data
-                            self.awaiting_answer.add(user_id)
-                            context.user_data['language'] = language
-                            question = question_data
-            
-            if question:
-                # Don't send the "resending" message - just display the question with media
-                await self._display_question(update.message, question)
-            else:
-                await update.message.reply_text(
-                    "No active question to resend. Use /start to begin a new session."
-                )
+        # Sending changes no state, so it happens after the lock is released
+        if question:
+            # Don't send the "resending" message - just display the question with media
+            await self._display_question(update.message, question)
+        else:
+            await update.message.reply_text(MSG_RESEND_NONE)
     
     async def handle_skip(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Skip the current question"""
         user_id = update.effective_user.id
-        user_lock = await self._get_user_lock(user_id)
         
-        async with user_lock:
-            # Check if user is currently waiting for next question (not awaiting answer)
-            if user_id in self.active_questions and user_id not in self.awaiting_answer:
-                await update.message.reply_text(
-                    "⏳ Please wait for the next question to be sent before using /skip.\n"
-                    "You can use /stats to see your progress in the meantime."
-                )
-                return
-            
-            # Check if user has an active question
-            if user_id not in self.active_questions:
-                # Try to restore from database
-                session = await self.db.get_user_session(user_id)
-                if session:
-                    question_id = session.get('current_question_id')
-                    language = session.get('language', 'english')
-                    if question_id:
-                        question = await self.question_loader.get_question_by_id(question_id, language)
-                        if question:
-                            self.active_questions[user_id] = question
-                            context.user_data['language'] = language
-                        else:
-                            await update.message.reply_text("No active question to skip. Use /start to begin.")
-                            return
-                    else:
-                        await update.message.reply_text("No active question to skip. Use /start to begin.")
-                        return
+        # Fast path: refuse repeated /skip during an answer without queueing on the lock
+        state = self._state.get(user_id)
+        if state is not None and state.question and not state.awaiting:
+            await update.message.reply_text(MSG_SKIP_WAIT)
+            return
+        
+        async with self._get_user_lock(user_id):
+            # Check again under the lock; the answer may have started while waiting for it
+            state = self._state.get(user_id)
+            if state is not None and state.question and not state.awaiting:
+                notice = MSG_SKIP_WAIT
+            else:
+                # Check if user has an active question, else try to restore it from the database
+                state = await self._ensure_active_question(user_id, context)
+                if state is None:
+                    notice = MSG_SKIP_NONE
                 else:
-                    await update.message.reply_text("No active question to skip. Use /start to begin.")
+                    # Remove from awaiting if present
+                    state.awaiting = False
+                    
+                    # These sends stay locked: they must stay ordered with activating the next question.
+                    # The next question is picked while the acknowledgement is sent.
+                    next_question_task = asyncio.create_task(self._get_next_question(user_id, state.language))
+                    try:
+                        await update.message.reply_text(MSG_SKIP_ACK)
+                        
+                        await self.send_next_question(update.message, user_id, state.language, next_question_task)
+                    finally:
+                        _discard_task(next_question_task)  # If the acknowledgement failed
                     return
-            
-            # Remove from awaiting if present
-            if user_id in self.awaiting_answer:
-                self.awaiting_answer.remove(user_id)
-            
-            await update.message.reply_text("⏭️ Question skipped. Loading next question...")
-            
-            language = context.user_data.get('language', 'english')
-            await self.send_next_question(update.message, user_id, language)
\ No newline at end of file
+        
+        # Refusals change no state, so they are sent after the lock is released
+        await update.message.reply_text(notice)
\ No newline at end of file
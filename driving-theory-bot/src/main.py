@@ -13,6 +13,7 @@ from telegram.ext import (
     ContextTypes
 )
 
+from config import DATABASE, QUESTION_CACHE_SIZE, CONCURRENT_UPDATES, CONNECTION_POOL_SIZE
 from database.db_manager import DatabaseManager
 from utils.question_loader import QuestionLoader
 from utils.rate_limiter import RateLimiter
@@ -46,11 +47,11 @@ class DrivingTheoryBot:
             raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
         
         # Use optimized components with connection pooling
-        self.db_manager = DatabaseManager(pool_size=20)
+        self.db_manager = DatabaseManager(**DATABASE)
         
         # Get the parent directory of the driving-theory-bot folder
         questions_dir = Path(__file__).parent.parent.parent
-        self.question_loader = QuestionLoader(questions_dir)
+        self.question_loader = QuestionLoader(questions_dir, cache_size=QUESTION_CACHE_SIZE)
         
         # Rate limiter: 10 requests per minute per user, burst of 15
         self.rate_limiter = RateLimiter(rate=10, window=60, burst=15)
@@ -74,6 +75,9 @@ class DrivingTheoryBot:
         # Restore active sessions from previous bot run
         await self.quiz_handler.restore_sessions()
         logger.info("Sessions restored")
+        
+        # Reuse file_ids of media uploaded by previous runs
+        await self.quiz_handler.load_media_cache()
     
     async def shutdown(self):
         """Graceful shutdown"""
@@ -141,13 +145,19 @@ class DrivingTheoryBot:
         """Run the bot"""
         await self.initialize()
         
-        # Configure application with optimizations
+        # Configure application with optimizations. Every reply goes through the
+        # bot's pooled httpx client; size the pool to the update concurrency so
+        # concurrent handlers reuse keep-alive TLS connections instead of queueing
         self.application = (
             Application.builder()
             .token(self.token)
-            .concurrent_updates(True)  # Process updates concurrently
+            .concurrent_updates(CONCURRENT_UPDATES)  # Process updates concurrently
+            .connection_pool_size(CONNECTION_POOL_SIZE)  # One keep-alive connection per concurrent update
+            .http_version("1.1")
             .pool_timeout(60.0)  # Longer timeout for heavy load
-            .connection_pool_size(20)  # Larger connection pool
+            .read_timeout(30.0)
+            .write_timeout(30.0)
+            .connect_timeout(30.0)
             .build()
         )
         
@@ -158,9 +168,9 @@ class DrivingTheoryBot:
         
         logger.info("Bot started. Press Ctrl+C to stop.")
         logger.info("Configuration:")
-        logger.info("- Database pool size: 20 connections")
+        logger.info(f"- Database pool size: {DATABASE['pool_size']} connections")
         logger.info("- Rate limit: 10 requests/minute per user")
-        logger.info("- Concurrent updates: Enabled")
+        logger.info(f"- Concurrent updates: {CONCURRENT_UPDATES}, HTTP pool: {CONNECTION_POOL_SIZE} keep-alive connections")
         logger.info("- Memory optimization: LRU caching enabled")
         
         await self.application.updater.start_polling(
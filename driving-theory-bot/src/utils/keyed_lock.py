@@ -0,0 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+
+class AsyncKeyedLock:
+    """
+    One asyncio.Lock per key, kept only while someone holds or waits on it.
+    Reference counting frees idle locks deterministically and never drops a
+    lock that is still in use, so memory tracks active keys, not every key seen.
+    """
+    
+    def __init__(self):
+        # key -> [lock, holders + waiters]. Updates never span an await, so
+        # they are atomic on the event loop and need no guarding lock.
+        self._locks: Dict[Hashable, List] = {}
+    
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        """Hold the lock for key for the duration of the block"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+    
+    def __len__(self) -> int:
+        return len(self._locks)
@@ -2,7 +2,7 @@ import json
 import random
 import hashlib
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Collection, Dict, List, Optional, Any
 from functools import lru_cache
 import asyncio
 
@@ -13,8 +13,11 @@ class QuestionLoader:
     Designed to handle thousands of concurrent users.
     """
     
-    def __init__(self, questions_dir: Path):
+    def __init__(self, questions_dir: Path, cache_size: int = 128):
         self.questions_dir = questions_dir
+        # Per-instance C-level LRU sized from config (a decorator would fix maxsize
+        # at class definition and keep every loader instance alive via self)
+        self._get_question_pool = lru_cache(maxsize=cache_size)(self._build_question_pool)
         self._questions_cache = {}
         self._cache_lock = asyncio.Lock()
         self._question_index = {}  # Fast lookup by ID
@@ -114,9 +117,8 @@ class QuestionLoader:
         else:
             return data.get('questions', [])
     
-    @lru_cache(maxsize=128)
-    def _get_question_pool(self, language: str, exclude_hash: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get cached question pool for a language"""
+    def _build_question_pool(self, language: str, exclude_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Build question pool for a language (cached via _get_question_pool)"""
         if language == 'deutsch':
             questions = self._questions_cache.get('deutsch', [])
         elif language == 'mixed':
@@ -133,7 +135,7 @@ class QuestionLoader:
     async def get_random_question(
         self, 
         language: str, 
-        exclude_ids: Optional[List[str]] = None,
+        exclude_ids: Optional[Collection[str]] = None,
         user_id: Optional[int] = None
     ) -> Optional[Dict[str, Any]]:
         """Get random question with efficient exclusion"""
@@ -161,15 +163,27 @@ class QuestionLoader:
         """Get question by ID using index for O(1) lookup"""
         await self.initialize()
         
-        # Fast lookup using index
-        if question_id in self._question_index:
-            langs = self._question_index[question_id]
-            if language in langs:
-                return langs[language]
-            # Fallback to any available language
-            return next(iter(langs.values())) if langs else None
+        # The index is already an in-memory memo of every question; one probe per level
+        langs = self._question_index.get(question_id)
+        if not langs:
+            return None
+        question = langs.get(language)
+        if question is not None:
+            return question
+        # Fallback to any available language
+        return next(iter(langs.values()))
+    
+    async def get_questions_by_ids(self, question_ids: Collection[str], language: str) -> Dict[str, Dict[str, Any]]:
+        """Bulk get_question_by_id; ids that are not found are left out"""
+        await self.initialize()
         
-        return None
+        questions = {}
+        for question_id in question_ids:
+            langs = self._question_index.get(question_id)
+            if langs:
+                question = langs.get(language)
+                questions[question_id] = question if question is not None else next(iter(langs.values()))
+        return questions
     
     def get_question_count(self, language: str) -> int:
         """Get total number of questions for a language"""
@@ -115,6 +115,35 @@ class RateLimiter:
         return min(self.burst, bucket['tokens'] + tokens_to_add)
 
 
+class TokenBucket:
+    """
+    Single shared token bucket for bounding throughput of a bulk operation.
+    take() grants as many of the requested tokens as are available, so callers
+    can process part of a backlog now and defer the remainder.
+    """
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # Tokens added per second
+        self.burst = burst  # Max tokens held
+        self._tokens = burst
+        self._last_update = time.monotonic()
+    
+    def take(self, requested: int) -> int:
+        """Take up to `requested` tokens and return how many were granted"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_update) * self.rate)
+        self._last_update = now
+        
+        granted = min(requested, int(self._tokens))
+        self._tokens -= granted
+        return granted
+    
+    def time_until(self, tokens: int) -> float:
+        """Seconds until `tokens` (capped at the burst) can be granted in full"""
+        available = self._tokens + (time.monotonic() - self._last_update) * self.rate
+        return max(0.0, (min(tokens, self.burst) - available) / self.rate)
+
+
 class UserRequestQueue:
     """
     Queue system for handling user requests with priority.
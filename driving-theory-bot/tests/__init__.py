@@ -0,0 +1,6 @@
+"""Unit tests; run from driving-theory-bot with: python -m unittest discover -s tests -t ."""
+import sys
+from pathlib import Path
+
+# The bot imports its modules relative to src/, as main.py does when run from there
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,41 @@
+import unittest
+
+from handlers.quiz_handler import QuizHandler
+
+
+class ParseAnswerTextTest(unittest.TestCase):
+    def setUp(self):
+        self.parse = QuizHandler(None, None).parse_answer_text
+    
+    def test_single_letter(self):
+        self.assertEqual(self.parse("A"), [0])
+        self.assertEqual(self.parse("C"), [2])
+    
+    def test_separators_are_ignored(self):
+        for text in ("AB", "A,B", "A B", "A, B", " A;B. "):
+            with self.subTest(text=text):
+                self.assertEqual(self.parse(text), [0, 1])
+    
+    def test_keeps_first_seen_order(self):
+        self.assertEqual(self.parse("CA"), [2, 0])
+    
+    def test_duplicates_are_dropped(self):
+        self.assertEqual(self.parse("AAB,A"), [0, 1])
+    
+    def test_expects_upper_cased_input(self):
+        # handle_answer upper-cases once before parsing
+        self.assertEqual(self.parse("ab"), [])
+    
+    def test_non_ascii_and_digits_are_dropped(self):
+        self.assertEqual(self.parse("ÄA1Ü"), [0])
+    
+    def test_no_letters(self):
+        self.assertEqual(self.parse(""), [])
+        self.assertEqual(self.parse("12, 3"), [])
+    
+    def test_whole_alphabet(self):
+        self.assertEqual(self.parse("ZYXWVUTSRQPONMLKJIHGFEDCBA"), list(range(25, -1, -1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
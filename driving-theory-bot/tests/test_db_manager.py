@@ -0,0 +1,292 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import asynccontextmanager
+from datetime import datetime
+from unittest import mock
+
+from database.db_manager import SCHEMA_VERSION, DatabaseManager, WriteQueueFullError
+
+# Schema of the first release, before any table rebuilds
+BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        telegram_id INTEGER PRIMARY KEY,
+        username TEXT,
+        preferred_language TEXT NOT NULL DEFAULT 'english',
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        total_questions_answered INTEGER DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TABLE question_attempts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_telegram_id INTEGER NOT NULL,
+        question_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        is_correct BOOLEAN NOT NULL,
+        attempted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        time_taken_seconds INTEGER,
+        FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
+    );
+
+    CREATE TABLE spaced_repetition (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_telegram_id INTEGER NOT NULL,
+        question_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        repetition_count INTEGER DEFAULT 0,
+        ease_factor REAL DEFAULT 2.5,
+        interval_days INTEGER DEFAULT 1,
+        next_review TIMESTAMP NOT NULL,
+        last_reviewed TIMESTAMP NOT NULL,
+        UNIQUE(user_telegram_id, question_id, language),
+        FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
+    );
+
+    CREATE TABLE user_sessions (
+        user_telegram_id INTEGER PRIMARY KEY,
+        current_question_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        question_start_time TIMESTAMP,
+        awaiting_answer BOOLEAN DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_telegram_id) REFERENCES users(telegram_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX idx_attempts_user_time ON question_attempts(user_telegram_id, attempted_at DESC);
+    CREATE INDEX idx_attempts_question ON question_attempts(question_id);
+    CREATE INDEX idx_spaced_user_review ON spaced_repetition(user_telegram_id, next_review);
+    CREATE INDEX idx_sessions_updated ON user_sessions(updated_at DESC);
+
+    INSERT INTO users (telegram_id, username) VALUES (5, 'alice');
+    INSERT INTO question_attempts (user_telegram_id, question_id, language, is_correct, attempted_at)
+        VALUES (5, 'q1', 'english', 1, '2024-03-01 12:00:00');
+    INSERT INTO question_attempts (user_telegram_id, question_id, language, is_correct, attempted_at)
+        VALUES (5, 'q2', 'english', 0, '2024-03-01 12:01:00');
+    INSERT INTO spaced_repetition (user_telegram_id, question_id, language, next_review, last_reviewed)
+        VALUES (5, 'q1', 'english', '2024-03-02 12:00:00', '2024-03-01 12:00:00');
+    INSERT INTO user_sessions (user_telegram_id, current_question_id, language, question_start_time, updated_at)
+        VALUES (5, 'q3', 'deutsch', '2024-03-01 12:02:00', '2024-03-01 12:02:00');
+"""
+
+
+def _local_ms(text: str) -> int:
+    """Epoch milliseconds of a local-time ISO string, as the bot used to write them"""
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "test.db")
+        self.dbs = []
+    
+    async def asyncTearDown(self):
+        for db in self.dbs:
+            await db.close()
+    
+    async def connect(self, **kwargs) -> DatabaseManager:
+        # A long interval keeps the background flush out of the way; tests flush explicitly
+        kwargs.setdefault('batch_interval', 3600)
+        db = DatabaseManager(self.path, pool_size=3, **kwargs)
+        await db.connect()
+        self.dbs.append(db)
+        return db
+    
+    def query(self, sql: str) -> list:
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+
+class MigrationTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        conn = sqlite3.connect(self.path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.close()
+    
+    async def test_baseline_database_is_upgraded(self):
+        db = await self.connect()
+        
+        self.assertEqual(self.query("PRAGMA user_version"), [(SCHEMA_VERSION,)])
+        tables = dict(self.query("SELECT name, sql FROM sqlite_master WHERE type = 'table'"))
+        self.assertNotIn('WITHOUT ROWID', tables['users'])
+        self.assertNotIn('AUTOINCREMENT', tables['question_attempts'])
+        self.assertIn('WITHOUT ROWID', tables['spaced_repetition'])
+        self.assertIn('media_cache', tables)
+        self.assertFalse([name for name in tables if name.endswith('_old')])
+        
+        self.assertEqual(
+            self.query("SELECT question_id, is_correct, attempted_at FROM question_attempts ORDER BY id"),
+            [('q1', 1, _local_ms('2024-03-01 12:00:00')), ('q2', 0, _local_ms('2024-03-01 12:01:00'))]
+        )
+        self.assertEqual(
+            self.query("SELECT next_review, last_reviewed FROM spaced_repetition"),
+            [(_local_ms('2024-03-02 12:00:00'), _local_ms('2024-03-01 12:00:00'))]
+        )
+        session = await db.get_user_session(5)
+        self.assertEqual(session['current_question_id'], 'q3')
+        self.assertEqual(session['language'], 'deutsch')
+        self.assertEqual(session['question_start_time'], _local_ms('2024-03-01 12:02:00'))
+        self.assertEqual(session['updated_at'], _local_ms('2024-03-01 12:02:00'))
+        
+        user = await db.get_or_create_user(5)
+        self.assertEqual(user['username'], 'alice')
+        stats = await db.get_user_statistics(5)
+        self.assertEqual((stats['total_attempts'], stats['correct_answers']), (2, 1))
+    
+    async def test_failed_migration_leaves_the_database_untouched(self):
+        rebuild = DatabaseManager._rebuild_outdated_tables
+        
+        async def rebuild_then_fail(self, conn, schema):
+            await rebuild(self, conn, schema)
+            raise RuntimeError("crash mid-migration")
+        
+        db = DatabaseManager(self.path, pool_size=3)
+        with mock.patch.object(DatabaseManager, '_rebuild_outdated_tables', rebuild_then_fail):
+            with self.assertRaises(RuntimeError):
+                await db.connect()
+        # The failed start closed its connections
+        self.assertFalse(db.pool._initialized)
+        
+        self.assertEqual(self.query("PRAGMA user_version"), [(0,)])
+        tables = {name for (name,) in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertFalse({name for name in tables if name.endswith('_old')})
+        self.assertNotIn('media_cache', tables)
+        self.assertEqual(
+            self.query("SELECT attempted_at FROM question_attempts ORDER BY id"),
+            [('2024-03-01 12:00:00',), ('2024-03-01 12:01:00',)]
+        )
+        
+        # The next start migrates from the untouched original tables
+        await self.connect()
+        self.assertEqual(self.query("PRAGMA user_version"), [(SCHEMA_VERSION,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM question_attempts"), [(2,)])
+    
+    async def test_current_database_is_not_migrated_again(self):
+        await self.connect()
+        db = DatabaseManager(self.path, pool_size=3)
+        with mock.patch.object(db, '_rebuild_outdated_tables') as rebuild:
+            await db.connect()
+            self.dbs.append(db)
+        rebuild.assert_not_called()
+
+
+class SessionCacheTest(DatabaseTestCase):
+    async def test_missing_session_is_cached(self):
+        db = await self.connect()
+        with mock.patch.object(db.pool, 'fetchone', wraps=db.pool.fetchone) as fetchone:
+            self.assertIsNone(await db.get_user_session(1))
+            self.assertIsNone(await db.get_user_session(1))
+        self.assertEqual(fetchone.call_count, 1)
+    
+    async def test_save_and_clear_are_read_back_before_flushing(self):
+        db = await self.connect()
+        await db.get_or_create_user(1)
+        await db.save_user_session(1, 'q1', 'english', 1000, True)
+        with mock.patch.object(db.pool, 'fetchone') as fetchone:
+            session = await db.get_user_session(1)
+            self.assertEqual((session['current_question_id'], session['question_start_time']), ('q1', 1000))
+            await db.clear_user_session(1)
+            self.assertIsNone(await db.get_user_session(1))
+        fetchone.assert_not_called()
+    
+    async def test_flushed_session_is_read_from_the_database(self):
+        db = await self.connect()
+        await db.get_or_create_user(1)
+        await db.save_user_session(1, 'q1', 'english', 1000, True)
+        await db._flush_batch(rate_limited=False)
+        db._session_cache.clear()
+        session = await db.get_user_session(1)
+        self.assertEqual((session['current_question_id'], session['awaiting_answer']), ('q1', 1))
+
+
+class WriteQueueTest(DatabaseTestCase):
+    async def test_full_queue_sheds_attempts(self):
+        db = await self.connect(max_pending_writes=2)
+        await db.get_or_create_user(1)
+        await db.record_question_attempt(1, 'q1', 'english', True)
+        await db.record_question_attempt(1, 'q2', 'english', False)
+        with self.assertRaises(WriteQueueFullError):
+            await db.record_question_attempt(1, 'q3', 'english', True)
+        self.assertEqual(len(db._batch_queue), 2)
+        
+        await db._flush_batch(rate_limited=False)
+        await db.record_question_attempt(1, 'q3', 'english', True)
+        self.assertEqual(len(db._batch_queue), 1)
+    
+    async def test_rate_limited_flush_defers_the_remainder(self):
+        db = await self.connect(max_write_rate=1, max_write_burst=2)
+        await db.get_or_create_user(1)
+        for i in range(5):
+            await db.record_question_attempt(1, f'q{i}', 'english', True)
+        await db._flush_batch()
+        self.assertEqual(len(db._batch_queue), 3)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM question_attempts"), [(2,)])
+        stats = await db.get_user_statistics(1)
+        self.assertEqual(stats['total_attempts'], 5)
+    
+    async def test_throttled_flush_skips_the_writer(self):
+        db = await self.connect(max_write_rate=1, max_write_burst=2)
+        for i in range(5):
+            await db.record_question_attempt(1, f'q{i}', 'english', True)
+        await db._flush_batch()
+        with mock.patch.object(db.pool, 'write_transaction') as write_transaction:
+            await db._flush_batch()  # The bucket is empty
+        write_transaction.assert_not_called()
+        self.assertEqual(len(db._batch_queue), 3)
+    
+    async def test_throttled_backlog_does_not_spin_the_flusher(self):
+        db = await self.connect(batch_size=2, max_write_rate=4, max_write_burst=2)
+        with mock.patch.object(db._write_bucket, 'take', wraps=db._write_bucket.take) as take:
+            for i in range(20):
+                await db.record_question_attempt(1, f'q{i}', 'english', True)
+                await asyncio.sleep(0.025)
+        # Every queued attempt re-arms the flush; it should still wait for tokens
+        self.assertLessEqual(take.call_count, 4)
+    
+    def slow_commits(self, db: DatabaseManager):
+        """Patch the pool so each write transaction stays open a while before committing"""
+        write_transaction = db.pool.write_transaction
+        
+        @asynccontextmanager
+        async def slow_commit():
+            async with write_transaction() as conn:
+                yield conn
+                await asyncio.sleep(0.2)
+        
+        return mock.patch.object(db.pool, 'write_transaction', slow_commit)
+    
+    async def test_statistics_count_attempts_being_flushed(self):
+        db = await self.connect()
+        await db.get_or_create_user(1)
+        for i in range(3):
+            await db.record_question_attempt(1, f'q{i}', 'english', i != 1)
+        
+        with self.slow_commits(db):
+            flush = asyncio.create_task(db._flush_batch(rate_limited=False))
+            await asyncio.sleep(0.05)
+            stats = await db.get_user_statistics(1)
+            await flush
+        self.assertEqual((stats['total_attempts'], stats['correct_answers']), (3, 2))
+    
+    async def test_attempted_questions_include_attempts_being_flushed(self):
+        db = await self.connect()
+        for i in range(3):
+            await db.record_question_attempt(1, f'q{i}', 'english', True)
+        
+        with self.slow_commits(db):
+            flush = asyncio.create_task(db._flush_batch(rate_limited=False))
+            await asyncio.sleep(0.05)
+            attempted = await db.get_attempted_questions(1, 'english')
+            await flush
+        self.assertEqual(attempted, {'q0', 'q1', 'q2'})
+
+
+if __name__ == '__main__':
+    unittest.main()
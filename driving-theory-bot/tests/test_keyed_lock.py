@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+
+from utils.keyed_lock import AsyncKeyedLock
+
+
+class AsyncKeyedLockTest(unittest.IsolatedAsyncioTestCase):
+    async def test_same_key_is_exclusive(self):
+        locks = AsyncKeyedLock()
+        events = []
+        
+        async def worker(name):
+            async with locks.lock(1):
+                events.append(f"{name} in")
+                await asyncio.sleep(0.01)
+                events.append(f"{name} out")
+        
+        await asyncio.gather(worker("a"), worker("b"))
+        self.assertEqual(events, ["a in", "a out", "b in", "b out"])
+    
+    async def test_different_keys_run_concurrently(self):
+        locks = AsyncKeyedLock()
+        inside = asyncio.Event()
+        
+        async def holder():
+            async with locks.lock(1):
+                await inside.wait()
+        
+        task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        # Would deadlock if key 2 shared key 1's lock
+        async with locks.lock(2):
+            inside.set()
+        await task
+    
+    async def test_lock_is_dropped_once_released(self):
+        locks = AsyncKeyedLock()
+        async with locks.lock(1):
+            self.assertEqual(len(locks), 1)
+        self.assertEqual(len(locks), 0)
+    
+    async def test_lock_is_kept_while_a_waiter_remains(self):
+        locks = AsyncKeyedLock()
+        release = asyncio.Event()
+        remaining = []
+        
+        async def holder():
+            async with locks.lock(1):
+                await release.wait()
+            # Released, but the waiter has not run yet and still refers to the lock
+            remaining.append(len(locks))
+        
+        async def waiter():
+            async with locks.lock(1):
+                pass
+        
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holding, waiting)
+        self.assertEqual(remaining, [1])
+        self.assertEqual(len(locks), 0)
+    
+    async def test_cancelled_waiter_releases_its_reference(self):
+        locks = AsyncKeyedLock()
+        release = asyncio.Event()
+        
+        async def holder():
+            async with locks.lock(1):
+                await release.wait()
+        
+        async def waiter():
+            async with locks.lock(1):
+                pass
+        
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        release.set()
+        await holding
+        self.assertEqual(len(locks), 0)
+    
+    async def test_exception_in_block_releases_the_lock(self):
+        locks = AsyncKeyedLock()
+        with self.assertRaises(ValueError):
+            async with locks.lock(1):
+                raise ValueError("boom")
+        self.assertEqual(len(locks), 0)
+        async with locks.lock(1):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+from utils.rate_limiter import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('utils.rate_limiter.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_grants_up_to_the_burst(self):
+        bucket = TokenBucket(rate=10, burst=50)
+        self.assertEqual(bucket.take(30), 30)
+        self.assertEqual(bucket.take(30), 20)  # Partial grant of what is left
+        self.assertEqual(bucket.take(5), 0)
+    
+    def test_refills_at_the_rate(self):
+        bucket = TokenBucket(rate=10, burst=50)
+        bucket.take(50)
+        self.now += 1.5
+        self.assertEqual(bucket.take(100), 15)
+    
+    def test_refill_is_capped_at_the_burst(self):
+        bucket = TokenBucket(rate=10, burst=50)
+        bucket.take(10)
+        self.now += 60
+        self.assertEqual(bucket.take(100), 50)
+    
+    def test_fractional_tokens_carry_over(self):
+        bucket = TokenBucket(rate=4, burst=50)
+        bucket.take(50)
+        self.now += 0.125  # Half a token
+        self.assertEqual(bucket.take(1), 0)
+        self.now += 0.125
+        self.assertEqual(bucket.take(1), 1)
+    
+    def test_time_until_a_full_grant(self):
+        bucket = TokenBucket(rate=10, burst=50)
+        self.assertEqual(bucket.time_until(20), 0)
+        bucket.take(50)
+        self.assertEqual(bucket.time_until(20), 2.0)
+        self.assertEqual(bucket.time_until(500), 5.0)  # Capped at a full burst
+        self.now += 1.5
+        self.assertEqual(bucket.time_until(20), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()